@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmarks for the chatbot hot paths, driven by bench/corpus.txt.
+
+Run from the repository root:
+
+	python bench/benchmark.py            # report, and compare with bench/baseline.json
+	python bench/benchmark.py --save     # record the results as the new baseline
+
+The movie model is loaded once and every stage runs in its own forked
+process, so the memory reported for a stage is its own: peakMemoryMB is the
+process high water mark and extraMemoryMB how much the stage added on top of
+the loaded model and its setup. The exit status is 1 when a stage's p50
+or p95 is more than --tolerance (and --min-delta ms) slower than the
+baseline, so it can gate a deploy. Baselines only compare on the same machine.
+"""
+
+import argparse
+import collections
+import json
+import math
+import os
+import random
+import re
+import resource
+import sys
+import time
+import traceback
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT) # The data files are read relative to the repository root
+
+import moviemodel
+from chatbot import Chatbot, Frame
+from sessionstore import ChatSession
+
+CORPUS_FILENAME = 'bench/corpus.txt'
+BASELINE_FILENAME = 'bench/baseline.json'
+
+def readCorpus(filename=CORPUS_FILENAME):
+	"""List of (kind, message) pairs"""
+	corpus = []
+	for line in open(filename):
+		line = line.rstrip('\n')
+		if line.strip() == '' or line.startswith('#'):
+			continue
+		kind, message = line.split('\t', 1)
+		corpus.append((kind, message))
+	return corpus
+
+def getQueries(corpus):
+	"""Every quoted title in the corpus"""
+	return [query for kind, message in corpus for query in re.findall('"(.*?)"', message)]
+
+def getPreferences(bot, corpus):
+	"""A user who told us about every movie quoted in the corpus"""
+	preferences = collections.OrderedDict()
+	for kind, message in corpus:
+		if kind in ['title', 'typo']:
+			frame = Frame()
+			frame.movieQuery = bot.retrieveMovieTitle(message)
+			bot.updateFrame(frame, True)
+			if frame.movie is not None:
+				preferences[frame.movie] = bot.retrieveSentiment(message)
+	return preferences
+
+# Each stage gets a fresh Chatbot, the corpus, the number of rounds and
+# timed(fn, *args), which runs and times one operation.
+
+def benchReadData(bot, corpus, rounds, timed):
+	for i in range(rounds):
+		timed(moviemodel.MovieModel, bot.EDIT_LIMIT, bot.REGEX_DIFF) # A fresh copy, not the shared model
+
+def benchUpdateFrame(bot, corpus, rounds, timed):
+	for i in range(rounds):
+		for query in getQueries(corpus):
+			frame = Frame()
+			frame.movieQuery = query
+			timed(bot.updateFrame, frame)
+
+def benchRetrieveSentiment(bot, corpus, rounds, timed):
+	for i in range(rounds):
+		for kind, message in corpus:
+			timed(bot.retrieveSentiment, message)
+
+def benchRecommendUserCollaborative(bot, corpus, rounds, timed):
+	bot.preferences = getPreferences(bot, corpus)
+	for i in range(rounds * 10):
+		timed(bot.recommendUserCollaborative)
+
+def benchRecommendItemNeighbors(bot, corpus, rounds, timed):
+	bot.preferences = getPreferences(bot, corpus)
+	for i in range(rounds * 10):
+		timed(bot.recommendItemNeighbors)
+
+def benchRecommendFactorized(bot, corpus, rounds, timed):
+	bot.preferences = getPreferences(bot, corpus)
+	for i in range(rounds * 10):
+		timed(bot.recommendFactorized)
+
+def benchRecommendBestMovie(bot, corpus, rounds, timed):
+	bot.preferences = getPreferences(bot, corpus)
+	for i in range(rounds * 10):
+		timed(bot.recommendBestMovie)
+
+def benchRecommendBestGenre(bot, corpus, rounds, timed):
+	bot.preferences = getPreferences(bot, corpus)
+	for i in range(rounds * 10):
+		timed(bot.recommendBestGenre, 'Comedy')
+
+def benchProcessRecommendMovie(bot, corpus, rounds, timed):
+	preferences = getPreferences(bot, corpus)
+	for i in range(rounds * 10):
+		bot.preferences = collections.OrderedDict(preferences) # Rank from scratch each time
+		bot.recommendedMovies = []
+		bot.nextRecommendedIds = []
+		timed(bot.processRecommendMovie)
+
+def benchProcess(bot, corpus, rounds, timed):
+	for i in range(rounds):
+		bot.setSession(ChatSession()) # Replays the corpus as one conversation
+		for kind, message in corpus:
+			timed(bot.process, message)
+
+def benchProcessBatch(bot, corpus, rounds, timed):
+	# The corpus as a webhook batch from a few senders, timed per batch
+	messages = [('sender%d' % (i % 4), message) for i, (kind, message) in enumerate(corpus)]
+	for i in range(rounds):
+		timed(bot.process_batch, messages)
+
+STAGES = [
+	('read_data', benchReadData),
+	('updateFrame', benchUpdateFrame),
+	('retrieveSentiment', benchRetrieveSentiment),
+	('recommendUserCollaborative', benchRecommendUserCollaborative),
+	('recommendItemNeighbors', benchRecommendItemNeighbors),
+	('recommendFactorized', benchRecommendFactorized),
+	('recommendBestMovie', benchRecommendBestMovie),
+	('recommendBestGenre', benchRecommendBestGenre),
+	('processRecommendMovie', benchProcessRecommendMovie),
+	('process', benchProcess),
+	('process_batch', benchProcessBatch),
+]
+
+def getPeakMemory():
+	"""Peak resident memory of this process in MB"""
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+def percentile(samples, p):
+	"""Nearest rank percentile of sorted samples"""
+	return samples[max(0, int(math.ceil(p / 100.0 * len(samples))) - 1)]
+
+def runStage(name, bench, corpus, rounds):
+	"""Runs one stage, returns its statistics"""
+	random.seed(0) # The chatbot picks random replies
+	bot = Chatbot() # Uses the model the parent loaded, like a preloaded gunicorn worker
+	startMemory = getPeakMemory()
+	samples = []
+	def timed(fn, *args):
+		start = time.time()
+		fn(*args)
+		samples.append(time.time() - start)
+	bench(bot, corpus, rounds, timed)
+
+	samples.sort()
+	return {
+		'count': len(samples),
+		'p50Ms': percentile(samples, 50) * 1000.0,
+		'p95Ms': percentile(samples, 95) * 1000.0,
+		'p99Ms': percentile(samples, 99) * 1000.0,
+		'opsPerSec': len(samples) / sum(samples) if sum(samples) > 0 else 0.0,
+		'peakMemoryMB': getPeakMemory(),
+		'extraMemoryMB': getPeakMemory() - startMemory,
+	}
+
+def runForked(name, bench, corpus, rounds):
+	"""Runs a stage in a child process so memory measurements don't add up"""
+	readEnd, writeEnd = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(readEnd)
+		try:
+			result = runStage(name, bench, corpus, rounds)
+			os.write(writeEnd, json.dumps(result))
+		except Exception:
+			traceback.print_exc()
+		finally:
+			os._exit(0)
+	os.close(writeEnd)
+	output = ''
+	while True:
+		chunk = os.read(readEnd, 65536)
+		if not chunk:
+			break
+		output += chunk
+	os.close(readEnd)
+	os.waitpid(pid, 0)
+	if output == '':
+		raise RuntimeError('Stage %s failed' % name)
+	return json.loads(output)
+
+def compare(results, baseline, tolerance, minDelta):
+	"""Descriptions of the stages that got slower than the baseline, ignoring noise under minDelta ms"""
+	regressions = []
+	for name, stats in sorted(results.iteritems()):
+		if name not in baseline:
+			continue
+		for key in ['p50Ms', 'p95Ms']:
+			if stats[key] > baseline[name][key] * (1.0 + tolerance) and stats[key] - baseline[name][key] > minDelta:
+				regressions.append('%s %s: %.2f ms, baseline %.2f ms' % (name, key, stats[key], baseline[name][key]))
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmarks the chatbot hot paths.')
+	parser.add_argument('--rounds', type=int, default=5, help='passes over the corpus per stage')
+	parser.add_argument('--stage', action='append', help='only run these stages')
+	parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+	parser.add_argument('--baseline', default=BASELINE_FILENAME)
+	parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, 0.25 is 25%%')
+	parser.add_argument('--min-delta', type=float, default=0.5, help='ignore slowdowns smaller than this many ms')
+	parser.add_argument('--output', help='also write the results as JSON to this file')
+	args = parser.parse_args()
+
+	corpus = readCorpus()
+	Chatbot() # Loads the shared model before forking, compiling the artifact if it is stale
+
+	results = dict()
+	print '%-28s %7s %10s %10s %10s %10s %9s %9s' % ('stage', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'ops/s', 'peak MB', 'extra MB')
+	for name, bench in STAGES:
+		if args.stage and name not in args.stage:
+			continue
+		stats = runForked(name, bench, corpus, args.rounds)
+		results[name] = stats
+		print '%-28s %7d %10.3f %10.3f %10.3f %10.1f %9.1f %9.1f' % (name, stats['count'], stats['p50Ms'],
+			stats['p95Ms'], stats['p99Ms'], stats['opsPerSec'], stats['peakMemoryMB'], stats['extraMemoryMB'])
+
+	report = {'rounds': args.rounds, 'corpusSize': len(corpus), 'stages': results}
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2, sort_keys=True)
+	if args.save:
+		with open(args.baseline, 'w') as f:
+			json.dump(report, f, indent=2, sort_keys=True)
+		print 'Saved baseline to %s' % args.baseline
+		return 0
+	if not os.path.exists(args.baseline):
+		print 'No baseline at %s, run with --save to record one' % args.baseline
+		return 0
+
+	regressions = compare(results, json.load(open(args.baseline))['stages'], args.tolerance, args.min_delta)
+	for regression in regressions:
+		print 'REGRESSION ' + regression
+	if len(regressions) == 0:
+		print 'No regressions against %s' % args.baseline
+	return 1 if len(regressions) > 0 else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
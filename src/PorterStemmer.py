@@ -1,3 +1,4 @@
+import threading
 
 class PorterStemmer:
 	def __init__(self):
@@ -244,3 +245,28 @@ class PorterStemmer:
 		self.step5()
 		return self.b[self.k0:self.k+1]
 
+"""
+Thread safe, memoizing front end to PorterStemmer.
+
+PorterStemmer keeps the word it is working on in self.b / self.k / self.j,
+so one instance can't be shared between threads. Each thread gets its own
+and the stems are cached in a dict shared by all of them (dict reads and
+writes are atomic). The cache is cleared once it holds maxSize words.
+"""
+class CachedStemmer:
+	def __init__(self, maxSize=50000):
+		self.maxSize = maxSize
+		self.cache = dict()
+		self.local = threading.local()
+
+	def stem(self, word):
+		stemmed = self.cache.get(word)
+		if stemmed is None:
+			stemmer = getattr(self.local, 'stemmer', None)
+			if stemmer is None:
+				stemmer = self.local.stemmer = PorterStemmer()
+			stemmed = stemmer.stem(word)
+			if len(self.cache) >= self.maxSize:
+				self.cache = dict()
+			self.cache[word] = stemmed
+		return stemmed
@@ -7,14 +7,28 @@ FB Messenger Platform docs: https://developers.facebook.com/docs/messenger-platf
 This file creates your application.
 """
 
+import atexit
+import json
 import os
+import traceback
 import flask
-import requests
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, bindparam, event, select
+from sqlalchemy.dialects import postgresql
 from datetime import datetime
+import metrics
+import modelcache
+import recocache
 from chatbot import Chatbot
+from messenger import MessengerClient
+from pipeline import EventPipeline
+from sessionstore import SessionStore
+from todos import TodoCommands
+from userstore import UserStore
+from warmup import Warmup
 
-FACEBOOK_API_MESSAGE_SEND_URL = (
+# Can be pointed at a local stub of the Send API for testing.
+FACEBOOK_API_MESSAGE_SEND_URL = os.environ.get('FACEBOOK_API_MESSAGE_SEND_URL',
     'https://graph.facebook.com/v2.6/me/messages?access_token=%s')
 
 app = flask.Flask(__name__)
@@ -25,10 +39,36 @@ app.config['FACEBOOK_PAGE_ACCESS_TOKEN'] = os.environ[
     'FACEBOOK_PAGE_ACCESS_TOKEN']
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'mysecretkey')
 app.config['FACEBOOK_WEBHOOK_VERIFY_TOKEN'] = 'mysecretverifytoken'
+# Answer the todo list commands of get_tutorial before the movie bot sees them.
+app.config['TODO_COMMANDS_ENABLED'] = os.environ.get('TODO_COMMANDS_ENABLED', '') == '1'
+
+messenger = MessengerClient(FACEBOOK_API_MESSAGE_SEND_URL % (app.config['FACEBOOK_PAGE_ACCESS_TOKEN']))
 
 
 db = SQLAlchemy(app)
-chatbot = Chatbot()
+# MOVIE_DATABASE_URL reads the movie data from the tables moviedb.py loads, e.g.
+# the app's own database, instead of the files that ship with the slug.
+MOVIE_DATABASE_URL = os.environ.get('MOVIE_DATABASE_URL')
+
+def load_model(progress):
+    model = Chatbot(dataUrl=MOVIE_DATABASE_URL, progress=progress).model
+    model.freeze()
+    return model
+
+def is_model_compiled():
+    try:
+        return modelcache.isCompiled(Chatbot.EDIT_LIMIT, Chatbot.REGEX_DIFF, dataUrl=MOVIE_DATABASE_URL)
+    except Exception:
+        return False # Let the load say what's wrong, see /ready
+
+# A compiled movie model loads in a fraction of a second, so we load it right
+# here: with gunicorn --preload that's once in the master, and the forked workers
+# share its memory copy-on-write as long as nobody writes to it. Compiling it
+# takes a while, so then it's done in the background and we bind, answer /ready
+# and the webhook handshake right away. Workers forked before it's ready load
+# their own, which waits for the master's compile (see modelcache.loadModel).
+model_warmup = Warmup(load_model, name='model')
+model_warmup.start(background=not is_model_compiled())
 
 
 class User(db.Model):
@@ -49,6 +89,138 @@ class TodoItem(db.Model):
     # 'addresses' (containing a list of addresses) to each user.
     user = db.relationship('User', backref='todos')
 
+    __table_args__ = (
+        # 'list' and '$n' read one user's open (or completed) items in this order.
+        db.Index('ix_todo_item_user_completed_added', 'user_id', 'dateCompleted', 'dateAdded', 'id'),
+    )
+
+# 'search' is a substring match, a trigram index lets ILIKE '%str%' use it on Postgres.
+# Elsewhere it would be a plain index on text that no substring match can use.
+event.listen(TodoItem.__table__, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+event.listen(TodoItem.__table__, 'after_create',
+    DDL('CREATE INDEX ix_todo_item_text_trgm ON todo_item USING gin ("text" gin_trgm_ops)').execute_if(dialect='postgresql'))
+
+
+class ChatSessionRecord(db.Model):
+    """Conversation state of a sender, see sessionstore.ChatSession."""
+    id = db.Column(db.Integer, primary_key=True)
+    sender_id = db.Column(db.String(80), unique=True, nullable=False)
+    data = db.Column(db.Text, nullable=False) # JSON of ChatSession.toDict()
+    dateUpdated = db.Column(db.DateTime, nullable=False)
+    version = db.Column(db.Integer, nullable=False, server_default='0') # Bumped by every save
+
+
+def load_session(sender_id):
+    table = ChatSessionRecord.__table__
+    row = db.session.execute(select([table.c.version, table.c.data]).where(table.c.sender_id == sender_id)).first()
+    return None if row is None else (row.version, json.loads(row.data))
+
+def save_sessions(sessions):
+    """Upserts the sessions in one statement where the database allows, returns their new versions."""
+    if not flask.has_app_context(): # Called from the flush timer, outside of any request
+        with app.app_context():
+            return save_sessions(sessions)
+    table = ChatSessionRecord.__table__
+    rows = [{'sender_id': sender_id, 'data': json.dumps(data), 'dateUpdated': datetime.utcnow()}
+        for sender_id, data in sessions.iteritems()]
+    try:
+        if db.session.bind.dialect.name == 'postgresql':
+            statement = postgresql.insert(table).values([dict(row, version=1) for row in rows])
+            statement = statement.on_conflict_do_update(index_elements=[table.c.sender_id],
+                set_={'data': statement.excluded.data, 'dateUpdated': statement.excluded.dateUpdated,
+                      'version': table.c.version + 1}).returning(table.c.sender_id, table.c.version)
+            versions = dict(db.session.execute(statement).fetchall())
+        else:
+            # INSERT OR IGNORE makes sure there's a row, the update bumps its version
+            db.session.execute(table.insert().prefix_with('OR IGNORE', dialect='sqlite'),
+                [dict(row, version=0) for row in rows])
+            db.session.execute(table.update().where(table.c.sender_id == bindparam('key'))
+                .values(data=bindparam('newData'), dateUpdated=bindparam('newDate'), version=table.c.version + 1),
+                [{'key': row['sender_id'], 'newData': row['data'], 'newDate': row['dateUpdated']} for row in rows])
+            versions = dict(db.session.execute(select([table.c.sender_id, table.c.version])
+                .where(table.c.sender_id.in_(sessions.keys()))).fetchall())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return versions
+
+# Every sender gets their own conversation on top of the one loaded movie model.
+# Sessions are written behind: a worker picks up what another one saved, but not
+# what it hasn't saved yet, so keep flushInterval short.
+sessions = SessionStore(load_session, save_sessions)
+
+
+# Sender id -> User id, created on first contact with one upsert and then
+# answered from memory.
+users = UserStore(db, User)
+
+HOLDING_REPLY = "I'm still warming up, give me a moment and I'll get back to you!"
+
+def make_event_handler():
+    """Handler for one pipeline lane, with its own Chatbot over the shared model once it's loaded."""
+    lane_chatbots = []
+
+    def get_chatbot(chat_messages):
+        if len(lane_chatbots) == 0:
+            if not model_warmup.isReady():
+                # Let them know we're there, their messages wait in the lane until the model is loaded
+                for sender_id in set(sender_id for sender_id, text in chat_messages):
+                    messenger.send(sender_id, HOLDING_REPLY)
+            lane_chatbots.append(Chatbot(model=model_warmup.get()))
+        return lane_chatbots[0]
+
+    def handle_events(events):
+        messages = [(event['sender']['id'], event['message']['text']) for event in events]
+        with app.app_context():
+            responses = [None] * len(messages)
+            if todo_commands is not None:
+                for i, (sender_id, text) in enumerate(messages):
+                    command = todo_commands.parse(text)
+                    if command is not None:
+                        try:
+                            responses[i] = todo_commands.run(users.get(sender_id), command)
+                        except Exception:
+                            # Answer them and carry on with the rest of the batch
+                            print 'Failed to run %r for %s' % (command, sender_id)
+                            traceback.print_exc()
+                            db.session.rollback()
+                            responses[i] = Chatbot.ERROR_REPLY
+            # JSON gives us unicode, the movie model's titles and lexicon are UTF-8 byte strings
+            chat_messages = [(sender_id, text.encode('utf-8'))
+                for (sender_id, text), response in zip(messages, responses) if response is None]
+            lane_sessions = dict((sender_id, sessions.get(sender_id)) for sender_id, text in chat_messages)
+            chat_responses = iter([])
+            if len(chat_messages) > 0:
+                chat_responses = iter(get_chatbot(chat_messages).process_batch(chat_messages, lane_sessions))
+            responses = [response if response is not None else next(chat_responses) for response in responses]
+            for sender_id, session in lane_sessions.iteritems():
+                sessions.put(sender_id, session)
+        for (sender_id, text), message_send in zip(messages, responses):
+            messenger.send(sender_id, message_send)
+    return handle_events
+
+# Messages from the same sender are handled in order, different senders in
+# parallel. Whatever piled up in a lane is processed as one batch.
+events = EventPipeline(make_event_handler, lanes=4, name='events', batchSize=32)
+
+metrics.registry.gauge('webhook_events_queued', 'Webhook events waiting or being handled', events.depth)
+metrics.registry.gauge('messenger_messages_queued', 'Replies waiting to be sent', messenger.pipeline.depth)
+metrics.registry.gauge('chat_sessions_cached', 'Conversations held in memory', lambda: len(sessions))
+metrics.registry.gauge('recommendation_cache_entries', 'Recommendation results held in memory', lambda: len(recocache.cache))
+metrics.registry.gauge('users_cached', 'Sender ids resolved to users held in memory', lambda: len(users))
+metrics.registry.gauge('movie_model_ready', 'Whether the movie model is loaded', lambda: int(model_warmup.isReady()))
+
+def shutdown():
+    """Drains queued messages and writes back sessions before the worker exits."""
+    events.close(timeout=10.0)
+    with app.app_context():
+        sessions.flush()
+    messenger.flush(timeout=10.0)
+
+atexit.register(shutdown)
+
 
 @app.route('/')
 def index():
@@ -96,6 +268,24 @@ def get_tutorial():
     #tutorial_send += "\n- 'clear all', 'clear completed', 'clear todo' will respectively, clear all lists, clear the list of completed tasks, and clear the current todo list"
     return tutorial_send
 
+todo_commands = TodoCommands(db, TodoItem, get_tutorial()) if app.config['TODO_COMMANDS_ENABLED'] else None
+
+@app.before_request
+def start_model_warmup():
+    """A worker forked before the model was loaded starts loading its own."""
+    model_warmup.start()
+
+@app.route('/ready')
+def ready():
+    """Readiness of this worker, 503 with the loading progress until the movie model is loaded."""
+    status = model_warmup.status()
+    return flask.Response(json.dumps(status), status=200 if status['ready'] else 503, mimetype='application/json')
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Latency histograms and counters of this worker, for Prometheus to scrape."""
+    return flask.Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/fb_webhook', methods=['GET', 'POST'])
 def fb_webhook():
     # Handle the initial handshake request.
@@ -130,11 +320,8 @@ def fb_webhook():
                 continue
             sender_id = event['sender']['id']
 
-            message_send = chatbot.process(message)
-
-            request_url = FACEBOOK_API_MESSAGE_SEND_URL % (app.config['FACEBOOK_PAGE_ACCESS_TOKEN'])
-            requests.post(request_url, headers={'Content-Type': 'application/json'},
-                          json={'recipient': {'id': sender_id}, 'message': {'text': message_send}})
+            # Answered in the background, Facebook redelivers if we're slow to return.
+            events.submit(sender_id, event)
 
     # Return an empty response.
     return ''
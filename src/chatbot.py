@@ -9,9 +9,17 @@ import math
 
 import numpy as np
 import re, collections
-from movielens import ratings
+import traceback
+import factorization
+import metrics
+import modelcache
+import movielens
+import moviemodel
+import recocache
 from random import randint
-from PorterStemmer import PorterStemmer
+from sentiment import SentimentEngine
+from sessionstore import ChatSession
+from userprofile import UserProfile
 from random import randrange, sample, getrandbits
 
 """
@@ -20,7 +28,7 @@ to dictate whether it should keep filling the frame or move on to the next set o
 This is based on the frame dialog model from lecture.
 """
 class Frame:
-	NO_SENTIMENT = -999 #Sentinel value
+	NO_SENTIMENT = SentimentEngine.NO_SENTIMENT
 
 	def __init__(self):
 		self.reset()
@@ -38,24 +46,8 @@ class Frame:
 		ret += "; Sentiment: %s" % (self.sentiment)
 		return ret
 
-class Movie: 
-	def __init__(self, name = "", year = "", gens = ""):
-		self.movieName = name.strip()
-		self.titles = [self.movieName]
-		self.year = year
-		self.genres = set(gens.split("|"))
-		self.id = 0
-
-	def printMovie(self):
-		return self.titles[0]# + " from " + self.year
-
-	def recoPrintMovie(self):
-		if len(self.year) == 4:
-			return "%s (%s)" % (self.titles[0], self.year)
-		return printMovie()
-
-	def __str__ (self):
-		return "%s (%s)" % (self.movieName, str(self.year))
+stageSeconds = metrics.registry.histogram('chatbot_stage_seconds',
+	'Time spent in each stage of handling a message', 'stage')
 
 """
 Used for the chatbot to remember between queries where
@@ -69,21 +61,35 @@ class ChatbotStateClassEnum:
 
 class Chatbot:
 	"""Simple class to implement the chatbot for PA 6."""
+	EDIT_LIMIT = 3 # The movie model's title index is built for these
+	REGEX_DIFF = EDIT_LIMIT * 4
+	ERROR_REPLY = "Sorry, I got muddled up there. Could you tell me that another way?"
+	PROFILE_CACHE_SIZE = 64 # Senders whose UserProfile process_batch keeps, some 150KB each
 
-	def __init__(self, is_turbo=False):
+	def __init__(self, is_turbo=False, model=None, dataUrl=None, progress=modelcache.noProgress):
 		self.name = 'Tanay and Nathan\'s MovieBot'
 		self.is_turbo = is_turbo
 		self.frame = Frame()
 		self.multiFrame = []
 		self.prevFrame = None
-		self.stemmer = PorterStemmer()
-		self.genreList = set()
-		self.read_data()
-		self.preferences = dict()
-		self.recommendedMovies = []
-		self.EDIT_LIMIT = 3
 		self.MIN_PREF_COUNT = 4
-		self.REGEX_DIFF = self.EDIT_LIMIT * 4
+		self.RECOMMENDATION_ENGINE = "item" # Which of self.recommenders processRecommendMovie blends with the genres
+		self.GENRE_WEIGHT = 1.0 # How much the genre scores and the engine's scores count in the blend
+		self.ENGINE_WEIGHT = 1.0
+		self.RECOMMENDATION_COUNT = 10 # Ranked at once, the rest are the next best recommendations
+		self.recommenders = {"user": self.recommendUserCollaborative, "item": self.recommendItemNeighbors,
+			"factor": self.recommendFactorized}
+		self.model = model
+		self.DATA_URL = dataUrl # Database with the MovieLens data (see moviedb), None reads the files in data/
+		self.batchTitleScores = None # Scores shared by the messages of a batch, see process_batch
+		self.batchSentiments = None
+		self.read_data(progress)
+		self.preferences = collections.OrderedDict() # Ordered so sessions can forget the oldest first
+		self.recommendedMovies = []
+		self.nextRecommendedIds = [] # Runners up of the last recommendation, best first
+		self.profile = None # Follows self.preferences, see getProfile
+		self.senderProfiles = collections.OrderedDict() # Sender -> their profile, least recently used first
+		self.recommendationCache = recocache.cache
 		self.ChatbotState = ChatbotStateClassEnum()
 		self.state = self.ChatbotState.ASK_MOVIE_INFO
 	#############################################################################
@@ -137,47 +143,69 @@ class Chatbot:
 		return previous_row[-1]
 
 	#str1: movieName, str2: movieQuery, regexPattern
-	def getStringDifference(self, str1, str2, regexPattern):
+	#typoDistances: precomputed edit distances from TitleIndex.search, if any
+	def getStringDifference(self, str1, str2, regexPattern, typoDistances = None):
 		if str2 in str1:
 			return len(str1) - len(str2)
 		if len(str1) - len(str2) <= self.REGEX_DIFF: # Movie contains query and is similar
 			if len(re.findall(regexPattern.lower(), str1.lower())) > 0:
 				return len(str1) - len(str2)
 			else:	#Movie doesn't contain query, but has spelling mistakes
-				levDist = self.levenshteinDistance(str1.lower(), str2.lower())
+				if typoDistances is None:
+					levDist = self.levenshteinDistance(str1.lower(), str2.lower())
+				else:
+					levDist = typoDistances.get(str1.lower(), self.EDIT_LIMIT + 1)
 				if levDist <= self.EDIT_LIMIT:
 					return levDist * 4
 		return 111
 
-	def getMovieDifference(self, movie1, movie2, actualYear):
-		regexPattern = movie2.replace(' ', '.*')
-		best = self.getStringDifference(movie1, movie2, regexPattern)
+	def getMovieDifference(self, movie1, movie2, actualYear, typoDistances = None):
+		# The words in order, taken literally ("c++" isn't a pattern), see TitleIndex.getRequiredLiterals
+		regexPattern = '.*'.join(re.escape(word) for word in movie2.split(' '))
+		best = self.getStringDifference(movie1, movie2, regexPattern, typoDistances)
 		if actualYear != None:
-			best = min(best, self.getStringDifference(movie1 + ".*" + (actualYear), movie2, regexPattern))
-			best = min(best, self.getStringDifference(movie1 + ".*(" + (actualYear) + ")", movie2, regexPattern))
+			best = min(best, self.getStringDifference(movie1 + ".*" + (actualYear), movie2, regexPattern, typoDistances))
+			best = min(best, self.getStringDifference(movie1 + ".*(" + (actualYear) + ")", movie2, regexPattern, typoDistances))
 		return best
 
-	def updateFrame(self, frame, greedySelect = False):
-		if frame.movieQuery == "":
-			return 
-		
+	def scoreTitles(self, movieQuery):
+		"""Dict of the movies matching the query to their distance from it"""
+		if self.batchTitleScores is not None and movieQuery in self.batchTitleScores:
+			return self.batchTitleScores[movieQuery]
+
 		#Can also try bag of words
 
 		potentialMoviesDict = dict()
-		# print frame.movieQuery
+		# print movieQuery
+
+		# Only score the movies the trigram index can't rule out
+		candidateIds, typoDistances = self.model.titleIndex.search(movieQuery)
+		movies = [self.model.titles[i] for i in candidateIds]
 
-		for movie in self.titles: # TODO: Restrict search to elements in potentialMovies if it exists 
+		for movie in movies: # TODO: Restrict search to elements in potentialMovies if it exists 
 			for movie_title in movie.titles:
-				dist = self.getMovieDifference(movie_title, frame.movieQuery, movie.year)
+				dist = self.getMovieDifference(movie_title, movieQuery, movie.year, typoDistances)
 				if dist <= self.REGEX_DIFF:
 					potentialMoviesDict[movie] = dist
-				if(frame.movieQuery.lower() in movie_title.lower() and len(frame.movieQuery) >= 10): # account for titles of series like "Harry Potter"
+				if(movieQuery.lower() in movie_title.lower() and len(movieQuery) >= 10): # account for titles of series like "Harry Potter"
 					potentialMoviesDict[movie] = dist
 
+		if self.batchTitleScores is not None:
+			self.batchTitleScores[movieQuery] = potentialMoviesDict
+		return potentialMoviesDict
+
+	@stageSeconds.time('updateFrame')
+	def updateFrame(self, frame, greedySelect = False):
+		if frame.movieQuery == "":
+			return 
+		
+		potentialMoviesDict = self.scoreTitles(frame.movieQuery)
+
 		# for movie, dist in potentialMoviesDict.iteritems():
 		# 	print movie.printMovie(), dist
 		if len(potentialMoviesDict) > 0:
-			frame.potentialMovies = sorted(potentialMoviesDict, key=potentialMoviesDict.get)
+			# Ties go to the lowest movie id, not to wherever the dict happens to put them
+			frame.potentialMovies = sorted(potentialMoviesDict, key=lambda movie: (potentialMoviesDict[movie], movie.id))
 			if potentialMoviesDict[frame.potentialMovies[0]] == 0 and (len(frame.potentialMovies) < 2 or potentialMoviesDict[frame.potentialMovies[1]]) > 0:
 				frame.potentialMovies = frame.potentialMovies[:1]
 			# print frame.potentialMovies[0]
@@ -195,17 +223,9 @@ class Chatbot:
 		# Else, prompt the user with the movies
 
 	def getNonMovieString(self, line):
-		out = ""
-		depth = 0
-		for c in line:
-			if c == '"':
-				depth = 1 - depth
-			elif depth == 0:
-				if c not in "!@#$%^&*()_+}{][\|;:.,></?":
-					out += c
-		c.replace('  ', ' ')
-		return out
+		return self.model.sentimentEngine.getNonMovieString(line)
 
+	@stageSeconds.time('retrieveMovieTitle')
 	def retrieveMovieTitle(self, line):
 		#Write better version with is_turbo
 		pattern = '"(.*)"'
@@ -215,83 +235,16 @@ class Chatbot:
 		return None
 
 	"""
-	Parameters:
-	Takes a raw input string.
-
-	Functionality:
-	Stems input string and compares to stemmed lexicon of 
-		positive and negative sentiment words.
-		Also adds support for negation words as from Assign3.
-
-	Return Postcondition:
-	Returns None if no input words are attached to any sentiment.
-	Returns > 0 for positive sentiment, higher is more
-	Returns < 0 for negative sentiment, lower is more
-	Returns 0 for equal positive and negative sentiment
+	Returns the sentiment score of the raw input string, see SentimentEngine.score.
+	Frame.NO_SENTIMENT if no input words are attached to any sentiment.
 	"""
+	@stageSeconds.time('retrieveSentiment')
 	def retrieveSentiment(self, input):
-		exclaimCount = (input.count("!") + 1) / 2
-
-		splitInput = self.getNonMovieString(input).split()
-
-		negationIndexes = set()
-		for i, word in enumerate(splitInput):
-			if word.lower() in ["though", "although", "scarcely", "barely", "hardly",
-									"nor", "not", "neither", "none", "nobody", "nope", "nah", "never",
-									"shouldnt", "couldnt", "werent", "wasnt", "doesnt", "isnt", "arent", "didnt"
-									"shouldn't", "couldn't", "weren't", "wasn't", "doesn't", "isn't", "aren't", "didn't"]:
-				negationIndexes.add(i)
-
-		def exagerrate(exg):
-			w = ""
-			for c in exg:
-				w += c + '+'
-			return w 
-
-		exagerrationWords = ["really", "very", "absolutely", "extremely", "quite", "rather", "terribly", "too", "very"]
-		exagerrationPatterns = [exagerrate(exg) for exg in exagerrationWords]
-		stemmedInput = [self.stemmer.stem(x.lower()) for x in splitInput]
-		# TODO: Add more sentiment features with other datasets 
-		# TODO: Add support for scaling words with NOT, and words like VERY, REALLY, etc
-		# Can use regex for really, etc: "r+e+a+l+l+y+ (\w+)" // Can split the words and add the +s
-		numPositiveWords = 0
-		numNegativeWords = 0
-		sentimentWordsExist = False
-		currentlyOpposite = False
-		sentiWords = [self.stemmer.stem(x) for x in ["love", "hate", "favorite", "disgusting"]]
-		focusWords = ["but", "however", "although", "therefore", "thus", "hence"]
-		isFocus = 1
-		mult = 1
-
-		MULT = 1.2
-		for i, w in enumerate(stemmedInput):
-			if i in negationIndexes:
-				currentlyOpposite = not currentlyOpposite
-				continue
-			word = splitInput[i]
-			if word.upper() == word: 
-				mult *= MULT
-			if w in focusWords:
-				isFocus = MULT ** 2
-				# print w
-			if w in sentiWords:
-				mult *= MULT
-
-			if (self.sentiment[w] == "pos" and not currentlyOpposite) or (self.sentiment[w] == "neg" and currentlyOpposite):
-				numPositiveWords += mult * isFocus
-				sentimentWordsExist = True
-			if (self.sentiment[w] == "pos" and currentlyOpposite) or (self.sentiment[w] == "neg" and not currentlyOpposite):
-				numNegativeWords += mult * isFocus
-				sentimentWordsExist = True
-
-			mult = 1
-			for pattern in exagerrationPatterns: 
-				if len(re.findall(pattern, word.lower())) > 0:
-					mult *= MULT
-					if word.upper() == word: 
-						mult *= MULT
-
-		return (numPositiveWords - numNegativeWords) * (1 + exclaimCount) if sentimentWordsExist else self.frame.NO_SENTIMENT
+		if self.batchSentiments is None:
+			return self.model.sentimentEngine.score(input)
+		if input not in self.batchSentiments:
+			self.batchSentiments[input] = self.model.sentimentEngine.score(input)
+		return self.batchSentiments[input]
 
 
 	"""Takes the input string from the REPL and call delegated functions
@@ -357,6 +310,7 @@ class Chatbot:
 			response += "How did you like %s?\n" % frame.movie.printMovie()
 		elif not frame.addedCurrentMovie:
 			self.preferences[frame.movie] = frame.sentiment
+			self.nextRecommendedIds = [] # Ranked for the old preferences
 			response += self.movieCommentingTalk(frame.sentiment, frame.movie)
 			#Put this in for now, later on we want to 
 			if len(self.preferences) == self.MIN_PREF_COUNT or \
@@ -401,6 +355,7 @@ class Chatbot:
 			response += self.processSingleMovieSentence(frame)+ "\n "
 		return response
 
+	@stageSeconds.time('processAskForRecommendation')
 	def processAskForRecommendation(self, input):
 		input = self.getNonMovieString(input)
 		words = input.lower().split()
@@ -412,8 +367,8 @@ class Chatbot:
 				shouldRecommend = True
 		if not shouldRecommend:
 			return ""
-		recoMovies = []
-		for genre in self.genreList:
+		recoMovies = np.array([], dtype=np.int64)
+		for genre in self.model.genreList:
 			if genre.lower() in words:
 				recoMovies = self.recommendBestGenre(genre)
 				break
@@ -453,12 +408,12 @@ class Chatbot:
 				alreadySeen = True
 
 			for i in range(len(words) - 1):
-				if self.sentiment[words[i]] != None:
+				if self.model.sentiment.get(words[i], "") != None:
 					if words[i + 1] in ["this", "it", "the", "that"]:
 						alreadySeen = True
 
 			for i in range(1, len(words)):
-				if self.sentiment[words[i]] != None:
+				if self.model.sentiment.get(words[i], "") != None:
 					if words[i - 1] in ["was", "is"]:
 						alreadySeen = True
 
@@ -504,6 +459,7 @@ class Chatbot:
 			response = self.smallTalk()
 		return response
 
+	@stageSeconds.time('process')
 	def process(self, input):
 		
 		input = input.strip()
@@ -514,106 +470,129 @@ class Chatbot:
 		
 		return response
 
-	def processRecommendMovieFromList(self, recos):
-		if recos == None or len(recos) == 0:
+	"""
+	Parameters:
+	A list of (sender, message) pairs, and optionally a dict of sender ->
+		ChatSession to continue the conversations from. It is updated in place,
+		senders missing from it start a new conversation.
+
+	Returns:
+	The responses to the messages, in order.
+
+	Each sender's messages are processed in order against their own session,
+	exactly like calling process one message at a time. Their UserProfile is
+	kept for the next batch, see PROFILE_CACHE_SIZE. Title matching and
+	sentiment only depend on the text, so they are worked out once for all
+	the distinct queries in the batch. The chatbot's own conversation is left
+	as it was.
+
+	A message we fail to answer gets ERROR_REPLY and leaves its sender's
+	session as it was before it, the rest of the batch carries on.
+	"""
+	def process_batch(self, messages, sessions = None):
+		if sessions is None:
+			sessions = dict()
+		bySender = collections.OrderedDict()
+		for i, (sender, message) in enumerate(messages):
+			bySender.setdefault(sender, []).append(i)
+
+		texts = list(set(message.strip() for sender, message in messages))
+		self.batchSentiments = dict(zip(texts, self.model.sentimentEngine.score_many(texts)))
+		self.batchTitleScores = dict()
+		for query in set(self.retrieveMovieTitle(text) for text in texts):
+			if query: # Most messages name their movie in quotes, the rest are scored as they come up
+				try:
+					self.scoreTitles(query)
+				except Exception:
+					pass # Tried again, and answered for, with the message that asked
+
+		ownSession = self.getSession()
+		ownProfile = self.profile
+		responses = [None] * len(messages)
+		try:
+			for sender, indexes in bySender.iteritems():
+				self.setSession(sessions.get(sender) or ChatSession())
+				self.profile = self.senderProfiles.pop(sender, None) # getProfile checks it still fits
+				for i in indexes:
+					before = self.getSession()
+					try:
+						responses[i] = self.process(messages[i][1])
+					except Exception:
+						print 'Failed to answer %r' % messages[i][1]
+						traceback.print_exc()
+						responses[i] = self.ERROR_REPLY
+						self.setSession(before) # Carry on from where the conversation was
+				sessions[sender] = self.getSession()
+				if self.profile is not None:
+					self.senderProfiles[sender] = self.profile
+					while len(self.senderProfiles) > self.PROFILE_CACHE_SIZE:
+						self.senderProfiles.popitem(last=False)
+		finally:
+			self.batchTitleScores = None
+			self.batchSentiments = None
+			self.setSession(ownSession)
+			self.profile = ownProfile
+		return responses
+
+	def getSession(self):
+		"""Snapshot of the conversation state, see sessionstore.ChatSession"""
+		return ChatSession(self.state, self.frame.movieQuery,
+			None if self.frame.movie is None else self.frame.movie.id, self.frame.sentiment,
+			[movie.id for movie in self.frame.potentialMovies], self.frame.addedCurrentMovie,
+			[[movie.id, sentiment] for movie, sentiment in self.preferences.iteritems()],
+			[movie.id for movie in self.recommendedMovies], self.nextRecommendedIds)
+
+	def setSession(self, session):
+		"""Continues the conversation from a ChatSession, sharing the loaded movie model"""
+		self.frame = Frame()
+		self.frame.movieQuery = session.movieQuery
+		if isinstance(self.frame.movieQuery, unicode): # Sessions come back from JSON as unicode
+			self.frame.movieQuery = self.frame.movieQuery.encode('utf-8')
+		self.frame.movie = None if session.movieId is None else self.model.titles[session.movieId]
+		if session.sentiment is not None:
+			self.frame.sentiment = session.sentiment
+		self.frame.potentialMovies = [self.model.titles[i] for i in session.potentialMovieIds]
+		self.frame.addedCurrentMovie = session.addedCurrentMovie
+		self.multiFrame = []
+		self.prevFrame = None
+		self.preferences = collections.OrderedDict((self.model.titles[i], sentiment) for i, sentiment in session.preferences)
+		self.recommendedMovies = [self.model.titles[i] for i in session.recommendedMovieIds]
+		self.nextRecommendedIds = list(session.nextRecommendedIds)
+		self.state = session.state
+
+	def processRecommendMovieFromList(self, ids):
+		"""Recommends the first of the ranked movie ids"""
+		if ids is None or len(ids) == 0:
 			return ""
-		movie = sorted(recos, key=recos.get)[-1]
+		movie = self.model.titles[int(ids[0])]
 		self.recommendedMovies.append(movie)
 		self.state = self.ChatbotState.RECOMMENDED_MOVIE
 		return "I think you'd like %s\n" % (movie.recoPrintMovie())
 
+	@stageSeconds.time('processRecommendMovie')
 	def processRecommendMovie (self):
-		reco1 = self.recommendFromPreferenceGenres()
-		reco2 = self.recommendUserCollaborative()
-		recos = collections.defaultdict(lambda: 0)
-		for movie, rating in reco1.iteritems():
-			recos[movie] += rating
-		for movie, rating in reco2.iteritems():
-			recos[movie] += rating
-
-		return self.processRecommendMovieFromList(recos)
+		excluded = self.getExcludedMask()
+		# The preferences haven't changed since we last ranked, so neither have the scores
+		ids = np.array(self.nextRecommendedIds, dtype=np.int64)
+		ids = ids[~excluded[ids]]
+		if len(ids) == 0:
+			ids = self.getTopMovies(self.getHybridScores(), excluded, self.RECOMMENDATION_COUNT)
+		self.nextRecommendedIds = ids[1:].tolist()
+		return self.processRecommendMovieFromList(ids)
 	#############################################################################
 	# 3. Movie Recommendation helper functions                                  #
 	#############################################################################
 
 	def getTitleAndPhrasesFromTempTitle(self, temp_title):
-		title = ""
-		phrases = []
-		reading = True
-		curPhrase = ""
-		for c in temp_title:
-			if c == '(':
-				reading = False
-			elif c == ')':
-				reading = True
-			elif reading:
-				title += c
-				if c == ',':
-					phrases.append(curPhrase.strip())
-					curPhrase = ""
-				else:
-					curPhrase += c
-		if len(curPhrase.strip()) > 0:
-			phrases.append(curPhrase.strip())
-		return (title, phrases)
+		return movielens.getTitleAndPhrasesFromTempTitle(temp_title)
 
 	def getTitlesFromPhraseList(self, phrases):
-		buildTitle = ""
-		titleList = []
-		for phrase in phrases:
-			if phrase in ["The", "A", "An", "Le", "La", "Les", "L'"]:
-				buildTitle = phrase + " " + buildTitle
-				titleList.append(buildTitle)
-			else:
-				buildTitle = buildTitle + (", " if len(buildTitle) > 0 else "") + phrase
-				titleList.append(buildTitle)
-		return titleList
-
-	def read_data(self):
-		"""Reads the ratings matrix from file"""
-		# This matrix has the following shape: num_movies x num_users
-		# The values stored in each row i and column j is the rating for
-		# movie i by user j
-		titles, self.ratings = ratings()
-		#print titles
-		self.titles = []
-		for i, temp in enumerate(titles): 
-			temp_title = temp[0]
-			year = None
-			if temp[0][-1] == ')':
-				temp_title = temp_title[:-7]
-				year = temp[0][-5:-1]
-			else:
-				temp_title = temp[0]
-			
-			title, phrases = self.getTitleAndPhrasesFromTempTitle(temp_title)
-			titleList = self.getTitlesFromPhraseList(phrases)
-
-			akaPattern = "\(a.k.a. (.*?)\)"
-
-			matches = re.findall(akaPattern, temp_title)
-			if len(matches) == 0:
-				akaPattern = "\(([^\d]+?)\)"
-				matches = re.findall(akaPattern, temp_title)
-				# if len(matches) > 0:
-				# 	print matches
-			for match in matches:
-				_, phrases = self.getTitleAndPhrasesFromTempTitle(match)
-				akaTitleList = self.getTitlesFromPhraseList(phrases)
-				titleList.extend(akaTitleList)
-				# if year == "1997":
-				# 	print titleList
-			m = Movie(title, year, temp[1])
-			self.genreList = self.genreList.union(m.genres)
-			m.id = i
-			m.titles = titleList
-			self.titles.append(m)
-		reader = csv.reader(open('data/sentiment.txt', 'rb'))
-		sentiment = dict(reader)
-		self.sentiment = collections.defaultdict(lambda: "")
-
-		for k, v in sentiment.iteritems():
-			self.sentiment[self.stemmer.stem(k)] = v
+		return movielens.getTitlesFromPhraseList(phrases)
+
+	def read_data(self, progress=modelcache.noProgress):
+		"""Uses the process wide movie model unless we were given one, see moviemodel"""
+		if self.model is None:
+			self.model = moviemodel.getSharedModel(self.EDIT_LIMIT, self.REGEX_DIFF, self.DATA_URL, progress)
 
 		# Change this later to use non-binarized data
 		#self.binarize()
@@ -624,19 +603,14 @@ class Chatbot:
 	Returns: None
 
 	Functionality:
-	Converts every element in our numpy ratings matrix above
+	Converts every rating in our sparse ratings matrix above
 		DIVIDER to 1, and below divider to -1.
 		Thus we are "binarizing" the ratings to a 1 or -1.
+		Movies a user hasn't rated stay unrated (0).
 	"""
 	def binarize(self, DIVIDER = 3.0):
 		"""Modifies the ratings matrix to make all of the ratings binary"""
-		SENTINEL = DIVIDER + 1.0
-
-		#print len(self.titles), self.ratings.shape
-
-		self.ratings[self.ratings > DIVIDER] = SENTINEL
-		self.ratings[self.ratings <= DIVIDER] = -1.0
-		self.ratings[self.ratings == SENTINEL] = 1.0
+		self.model.binarize(DIVIDER)
 
 
 	"""
@@ -650,92 +624,129 @@ class Chatbot:
 	def distance(self, u, v):
 		return np.dot(np.linalg.norm(np.array(u), ord=1), np.linalg.norm(np.array(v), ord=1))
 
+	def getHybridScores(self):
+		"""Weighted sum of the genre and engine scores, NaN for movies neither of them scored"""
+		# Scores only depend on the preferences, the exclusions are applied afterwards
+		key = self.recommendationCache.getKey(self.model, 'hybrid',
+			(self.RECOMMENDATION_ENGINE, self.GENRE_WEIGHT, self.ENGINE_WEIGHT),
+			[(movie.id, sentiment) for movie, sentiment in self.preferences.iteritems()])
+		return self.recommendationCache.get(self.model, key, self.computeHybridScores)
+
+	def computeHybridScores(self):
+		total = np.zeros(len(self.model.titles))
+		scored = np.zeros(len(self.model.titles), dtype=bool)
+		for weight, scores in [(self.GENRE_WEIGHT, self.recommendFromPreferenceGenres()),
+				(self.ENGINE_WEIGHT, self.recommenders[self.RECOMMENDATION_ENGINE]())]:
+			if scores is None:
+				continue
+			known = ~np.isnan(scores)
+			total[known] += weight * scores[known]
+			scored |= known
+		total[~scored] = np.nan
+		return total
+
+	def getTopMovies(self, scores, excluded, count):
+		"""Ids of the count best scored movies that aren't excluded, best first"""
+		candidates = np.flatnonzero(~excluded & ~np.isnan(scores))
+		if len(candidates) > count: # Only sort the few we keep
+			kth = -np.partition(-scores[candidates], count - 1)[count - 1]
+			better = candidates[scores[candidates] > kth]
+			tied = candidates[scores[candidates] == kth] # Lowest ids win ties, so the ranking is repeatable
+			candidates = np.concatenate([better, tied[:count - len(better)]])
+		return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+	def getExcludedIds(self):
+		"""Ids of the movies we don't want to recommend"""
+		return [movie.id for movie in self.preferences] + [movie.id for movie in self.recommendedMovies]
+
+	def getExcludedMask(self):
+		"""Boolean mask over movie ids of movies we don't want to recommend"""
+		excluded = np.zeros(len(self.model.titles), dtype=bool)
+		excluded[self.getExcludedIds()] = True
+		return excluded
+
+	def sentimentToRating(self, sentiment):
+		# transform from (-5 to 5) to (1 to 5), 0 is unrated
+		return 0.0 if sentiment is None else ((sentiment + 3.0) / 2.0 + 1.0)
+
+	# The recommenders below return an array of scores indexed by movie id,
+	# NaN for movies they have nothing to say about. Movies the user already
+	# told us about or we recommended are left for getExcludedMask to filter.
+
+	def getProfile(self):
+		"""The UserProfile of self.preferences, only adding what's new since the last call"""
+		current = [(movie.id, sentiment) for movie, sentiment in self.preferences.iteritems()]
+		if self.profile is None or self.profile.model is not self.model or \
+				self.profile.preferences != current[:len(self.profile.preferences)]:
+			self.profile = UserProfile(self.model) # A preference changed or went away, start over
+		for movieId, sentiment in current[len(self.profile.preferences):]:
+			self.profile.add(movieId, sentiment, self.sentimentToRating(sentiment))
+		return self.profile
+
 	def recommendUserCollaborative(self):
 		# Finds the most similar user with Pearson Correlation and rates movies based on their ratings 
-		# It then gives back a dict with (movie, potential rating combinations)
-
-		# first start by mean centering the user columns
-		ratings = np.apply_along_axis(lambda ratingVec: ratingVec - sum(ratingVec), 0, self.ratings)
+		profile = self.getProfile()
 
-		# then make an array characteristic of the user query
-		transformUserSentiment = lambda senti: 0.0 if senti is None else ((senti + 3.0) / 2.0 + 1.0) # transform from (-5 to 5) to (1 to 5)
-		ourUserVec = np.zeros(len(self.titles))
-		for movie, sentiment in self.preferences.iteritems():
-			ourUserVec[movie.id] = transformUserSentiment(sentiment)
-
-		# find the columns with positive PMI (PPMI)
-		similarityCoeffs = np.apply_along_axis(lambda ratingVec: self.distance(ratingVec, ourUserVec), 0, ratings)
-
-		validCoeffs = dict()
-		for userIndex, coeff in enumerate(similarityCoeffs):
-			if (coeff > 0):
-				validCoeffs[userIndex] = coeff
-
-		# fill in ratings for ourUserVec and return reco
-		bestMovieIndex = -1
-		bestMovieRating = -1
+		# No user has a positive similarity coefficient
+		if profile.ratedCount == 0 or not self.model.userWeights.any():
+			return self.recommendFromPreferenceGenres()
 
-		tempDict = dict()
+		# fill in ratings for the unfilled movies
+		return np.where(profile.rated, np.nan, self.model.collaborativeRatings)
 
-		coeffSum = sum(validCoeffs.values())
-		if coeffSum == 0:
+	def recommendItemNeighbors(self):
+		# Scores the neighbors of the movies the user told us about, weighted by
+		# how similar they are: the prediction for a movie is the similarity
+		# weighted average of the user's sentiment for its neighbors.
+		profile = self.getProfile()
+		touched = profile.neighborWeights > 0.0
+		if not touched.any(): # None of the movies have neighbors
 			return self.recommendFromPreferenceGenres()
-		for movieIndex in range(len(self.titles)):
-			movie = self.titles[movieIndex]
-			if movie in self.preferences or movie in self.recommendedMovies: #Don't want to recommend already watched movies
-				continue
-			if ourUserVec[movieIndex] == 0.0: #unfilled movie
-				movieRating = 0.0
-				for (userIndex, coeff) in validCoeffs.iteritems():
-					movieRating += coeff * ratings[movieIndex][userIndex]
-				movieRating = movieRating / coeffSum
-				ourUserVec[movieIndex] = movieRating
-				tempDict[movie] = movieRating
-				if bestMovieIndex == -1 or bestMovieRating < movieRating:
-					bestMovieIndex = movieIndex
-					bestMovieRating = movieRating
-
-		# ourUserVec is filled but it's sufficient just to return the best movie list here!
-		return tempDict
+		scores = np.full(len(self.model.titles), np.nan)
+		scores[touched] = profile.neighborTotals[touched] / profile.neighborWeights[touched]
+		return scores
+
+	def recommendFactorized(self):
+		# Folds the user into the factorization as if they were one of the
+		# users it was trained on, then predicts every movie at once
+		profile = self.getProfile()
+		if len(profile.preferences) == 0:
+			return self.recommendFromPreferenceGenres()
+		userFactor = factorization.foldIn(profile.factorGram, profile.factorRhs, len(profile.preferences),
+			self.model.factorRegularization, self.model.factorPriorCount)
+		return self.model.baselineRatings + self.model.itemFactors.dot(userFactor)
+
+	def getBestFromOrder(self, order, excluded, genre = None):
+		"""Movie ids in the ranked order that aren't excluded (and have the genre)"""
+		remaining = order[~excluded[order]]
+		if genre is not None:
+			remaining = remaining[self.model.genreMatrix[remaining, self.model.genreIds[genre]] > 0]
+		return remaining
 
 	# Creative++ function
-	# RETURNS MOVIE OBJECT
+	# RETURNS RANKED MOVIE IDS
 	def recommendBestMovie(self):
-		avg_ratings = dict()
-		for i in range(len(self.ratings)):
-			movie = self.titles[i]
-			if movie in self.preferences or movie in self.recommendedMovies: #Don't want to recommend already watched movies
-				continue
-			n = 0.0
-			tot = 0.0
-			for k in self.ratings[i]:
-				if k > 0.0:
-					tot += k
-					n += 1
-			if n != 0.0:
-				avg_ratings[movie] = tot / n
-			else:
-				avg_ratings[movie] = tot
-		# print avg_ratings
-		# #Recommend the best movie over all genres
-		# x = self.ratings.sum(axis = 1)
-		# print "RECO", x
-		return avg_ratings
+		# Walks down the precomputed ranking, skipping already watched movies
+		key = self.recommendationCache.getKey(self.model, 'best', (self.RECOMMENDATION_COUNT,), excludedIds=self.getExcludedIds())
+		return self.recommendationCache.get(self.model, key,
+			lambda: self.getBestFromOrder(self.model.bestMovieOrder, self.getExcludedMask())[:self.RECOMMENDATION_COUNT])
 
 	#Creative++ function
-	# RETURNS MOVIE OBJECT
+	# RETURNS RANKED MOVIE IDS
 	def recommendBestGenre(self, genre):
 		# Returns the highest rated (ratings based on previous users) movies based on genre 
 		# Just based on user matrix
-		#print genre
-		movieHasGenre = lambda movieIndex: (genre in self.titles[movieIndex].genres)
-		temp_ratings = self.recommendBestMovie()
-
-		avg_ratings = dict()
-		for movie, rating in temp_ratings.iteritems():
-			if genre in movie.genres:
-				avg_ratings[movie] = rating
-		return avg_ratings
+		if genre not in self.model.bestGenreOrder:
+			return np.array([], dtype=np.int64)
+		key = self.recommendationCache.getKey(self.model, 'genre', (genre, self.RECOMMENDATION_COUNT), excludedIds=self.getExcludedIds())
+		return self.recommendationCache.get(self.model, key, lambda: self.computeBestGenre(genre))
+
+	def computeBestGenre(self, genre):
+		excluded = self.getExcludedMask()
+		best = self.getBestFromOrder(self.model.bestGenreOrder[genre], excluded)
+		if len(best) == 0: # Exhausted the genre's top K, keep walking the full ranking
+			best = self.getBestFromOrder(self.model.bestMovieOrder, excluded, genre)
+		return best[:self.RECOMMENDATION_COUNT]
 
 	# Uses self.preferences
 	def recommendFromPreferenceGenres(self):
@@ -747,24 +758,12 @@ class Chatbot:
 		if len(self.preferences) < self.MIN_PREF_COUNT:
 			return None
 
-		genrePreferences = collections.defaultdict(lambda: 0)
+		ids = [movie.id for movie in self.preferences]
+		ratings = np.array([self.preferences[movie] for movie in self.preferences], dtype=np.float64)
+		genrePreferences = self.model.genreMatrix[ids].T.dot(ratings) # Weighted genres
 
-		posMovieCount = 0
-		for movie, rating in self.preferences.iteritems():
-			for genre in movie.genres:
-				genrePreferences[genre] += rating # Weighted genres
-		
-		movieScores = collections.defaultdict(lambda: 0)
-
-		for movieObj in self.titles:
-			if movieObj in self.preferences or movieObj in self.recommendedMovies: #Don't want to recommend already watched movies
-				continue
-			score = 0
-			for genre in movieObj.genres:
-				score += genrePreferences[genre]
-			movieScores[movieObj] = score
-		
-		return movieScores
+		# Every movie's score is the sum of the weights of its genres
+		return self.model.genreMatrix.dot(genrePreferences)
 
 
 	#############################################################################
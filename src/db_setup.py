@@ -1,3 +1,14 @@
+import os
+from datetime import datetime
+
+import moviedb
+from sqlalchemy import create_engine
+
+# The MovieLens tables go in first: importing app reads them. Without
+# MOVIE_DATABASE_URL the model comes from data/ and nothing would read them.
+if os.environ.get('MOVIE_DATABASE_URL'):
+	print 'Loaded MovieLens data %s' % moviedb.loadFiles(create_engine(os.environ['MOVIE_DATABASE_URL']))
+
 from app import TodoItem, User, db
 
 db.drop_all()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+"""
+Low rank factorization of the ratings matrix, trained offline by modelcache.
+
+A rating of movie i by user u is modelled as
+	globalMean + itemBiases[i] + itemFactors[i] . userFactors[u]
+The biases are damped mean offsets from the global mean, the factors are
+fit to what is left by alternating least squares: with the item factors
+fixed every user factor is a k x k regularized least squares solve, and
+the other way around. The k x k Gram matrices of all the rows are summed
+with one reduceat per factor and solved as a stack, so an iteration is a
+handful of numpy calls whatever the number of movies and users.
+
+Only the item side is kept. A chat user is folded in the same way a user is
+solved during training (see foldIn), so scoring every movie for them costs
+a k x k solve and one movies x k matrix-vector product. The sums foldIn
+needs grow one preference at a time, see userprofile.UserProfile.
+"""
+
+def solveFactors(rows, cols, values, fixed, numRows, regularization, priorCount):
+	"""Least squares factors of every row given the factors of the columns"""
+	rank = fixed.shape[1]
+	order = np.argsort(rows, kind='mergesort')
+	counts = np.bincount(rows, minlength=numRows)
+	starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+	rated = counts > 0
+	gathered = fixed[cols[order]]
+
+	# Per row sums over its ratings, one reduceat for all the rows at once
+	def sumRows(products):
+		sums = np.zeros((numRows,) + products.shape[1:])
+		if len(products) > 0:
+			sums[rated] = np.add.reduceat(products, starts[rated], axis=0)
+		return sums
+	gram = np.zeros((numRows, rank, rank))
+	for a in range(rank):
+		gram[:, a, a:] = sumRows(gathered[:, a, None] * gathered[:, a:])
+		gram[:, a:, a] = gram[:, a, a:]
+	# Regularization grows with the number of ratings (weighted lambda), plus
+	# priorCount so a movie a couple of users loved can't get huge factors
+	gram += (regularization * (counts + priorCount))[:, None, None] * np.eye(rank)
+	rhs = sumRows(gathered * values[order, None])
+	return np.linalg.solve(gram, rhs[:, :, None])[:, :, 0]
+
+def factorize(mat, rank, regularization, iterations, priorCount, seed=0):
+	"""Returns (globalMean, itemBiases, itemFactors) of the ratings matrix"""
+	numMovies, numUsers = mat.shape
+	values = mat.values()
+	globalMean = values.mean() if len(values) > 0 else 0.0
+	counts = mat.rowSums(np.ones(len(values)))
+	itemBiases = mat.rowSums(values - globalMean) / (counts + priorCount)
+	residuals = values - globalMean - itemBiases[mat.rows]
+
+	random = np.random.RandomState(seed)
+	itemFactors = random.normal(0.0, 0.1, (numMovies, rank))
+	for i in range(iterations):
+		userFactors = solveFactors(mat.indices, mat.rows, residuals, itemFactors, numUsers, regularization, priorCount)
+		itemFactors = solveFactors(mat.rows, mat.indices, residuals, userFactors, numMovies, regularization, priorCount)
+	return globalMean, itemBiases.astype(np.float32), itemFactors.astype(np.float32)
+
+def foldIn(gram, rhs, count, regularization, priorCount):
+	"""Factor of a new user who rated count movies, given the sums over those
+	movies of factor x factor and of factor * (rating - baseline)"""
+	return np.linalg.solve(gram + regularization * (count + priorCount) * np.eye(len(rhs)), rhs)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+
+import metrics
+import requests
+from pipeline import EventPipeline
+from requests.adapters import HTTPAdapter
+
+postSeconds = metrics.registry.histogram('messenger_post_seconds',
+	'Time taken by each Send API request, by outcome', 'outcome')
+messagesSent = metrics.registry.counter('messenger_messages_total',
+	'Outgoing messages by how they ended up', 'outcome')
+
+"""
+Background client for the Messenger Send API.
+
+send() only queues the message, so the webhook returns without waiting on
+Facebook. An EventPipeline of delivery lanes posts the queued messages over
+one pooled keep-alive session. Each recipient always goes through the same
+lane, so their messages arrive in order, and at most `lanes` requests are in
+flight. Timeouts, connection errors, 5xx and 429 responses are retried with
+exponential backoff. When a lane's queue is full, send() waits up to
+enqueueTimeout for room and then drops the message.
+"""
+class MessengerClient:
+	def __init__(self, url, lanes=4, maxQueue=1000, retries=4, backoff=0.5, timeout=5.0, enqueueTimeout=1.0):
+		self.url = url
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.sessionPid = None
+		self.lock = threading.Lock()
+		self.pipeline = EventPipeline(lambda: self.deliver, lanes, maxQueue, enqueueTimeout, name='messenger')
+
+	def getSession(self):
+		"""The pooled session of this process"""
+		with self.lock:
+			if self.sessionPid != os.getpid(): # Don't share sockets with the process we forked from
+				self.session = requests.Session()
+				adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pipeline.lanes)
+				self.session.mount('https://', adapter)
+				self.session.mount('http://', adapter)
+				self.sessionPid = os.getpid()
+			return self.session
+
+	def send(self, recipient_id, text):
+		"""Queues a text message, returns False if it had to be dropped"""
+		queued = self.pipeline.submit(recipient_id, {'recipient': {'id': recipient_id}, 'message': {'text': text}})
+		if not queued:
+			messagesSent.inc('dropped')
+		return queued
+
+	def flush(self, timeout=None):
+		"""Waits until every queued message has been delivered or given up on"""
+		return self.pipeline.join(timeout)
+
+	def deliver(self, payload):
+		"""Posts one message, retrying transient failures. Returns True on success"""
+		for attempt in range(self.retries + 1):
+			delay = self.backoff * (2 ** attempt)
+			start = time.time()
+			try:
+				response = self.getSession().post(self.url, json=payload, timeout=self.timeout)
+			except (requests.ConnectionError, requests.Timeout) as e:
+				postSeconds.observe(time.time() - start, 'error')
+				error = str(e)
+			else:
+				postSeconds.observe(time.time() - start, '%dxx' % (response.status_code / 100))
+				if response.status_code < 400:
+					messagesSent.inc('sent')
+					return True
+				error = 'HTTP %d: %s' % (response.status_code, response.text[:200])
+				if response.status_code != 429 and response.status_code < 500:
+					break # Our fault, retrying won't help
+				retryAfter = response.headers.get('Retry-After', '')
+				if retryAfter.isdigit():
+					delay = max(delay, int(retryAfter))
+			if attempt < self.retries:
+				time.sleep(delay)
+		messagesSent.inc('failed')
+		print 'Failed to send message to %s: %s' % (payload['recipient']['id'], error)
+		return False
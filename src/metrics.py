@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import functools
+import threading
+import time
+
+"""
+In-process counters, gauges and latency histograms, rendered in the
+Prometheus text format by Registry.render (see the /metrics route in app.py).
+
+Recording a value is a dict lookup and a couple of additions under a lock,
+and nothing is formatted until something scrapes the endpoint. Every metric
+has at most one label. Each gunicorn worker keeps its own numbers, so a
+scrape sees the worker that happened to answer it.
+"""
+
+# Seconds, from a cached lookup to a slow recommendation or Graph API call
+DEFAULT_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+def formatLabels(labelName, label, extra=''):
+	pairs = []
+	if labelName is not None:
+		pairs.append('%s="%s"' % (labelName, str(label).replace('\\', '\\\\').replace('"', '\\"')))
+	if extra:
+		pairs.append(extra)
+	return '{%s}' % ','.join(pairs) if len(pairs) > 0 else ''
+
+def formatValue(value):
+	if value == float('inf'):
+		return '+Inf'
+	return repr(float(value))
+
+class Counter:
+	def __init__(self, name, help, labelName=None):
+		self.name = name
+		self.help = help
+		self.labelName = labelName
+		self.values = dict()
+		self.lock = threading.Lock()
+
+	def inc(self, label=None, amount=1):
+		with self.lock:
+			self.values[label] = self.values.get(label, 0) + amount
+
+	def render(self):
+		lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+		for label, value in sorted(self.values.items()):
+			lines.append('%s%s %s' % (self.name, formatLabels(self.labelName, label), formatValue(value)))
+		return lines
+
+class Gauge:
+	"""A value read from a callback at scrape time, e.g. a queue depth"""
+	def __init__(self, name, help, callback):
+		self.name = name
+		self.help = help
+		self.callback = callback
+
+	def render(self):
+		return ['# HELP %s %s' % (self.name, self.help), '# TYPE %s gauge' % self.name,
+			'%s %s' % (self.name, formatValue(self.callback()))]
+
+class Histogram:
+	def __init__(self, name, help, labelName=None, buckets=DEFAULT_BUCKETS):
+		self.name = name
+		self.help = help
+		self.labelName = labelName
+		self.buckets = sorted(buckets)
+		self.counts = dict() # label -> observations per bucket, the last one is +Inf
+		self.sums = dict()
+		self.lock = threading.Lock()
+
+	def observe(self, value, label=None):
+		with self.lock:
+			counts = self.counts.get(label)
+			if counts is None:
+				counts = self.counts[label] = [0] * (len(self.buckets) + 1)
+				self.sums[label] = 0.0
+			counts[bisect.bisect_left(self.buckets, value)] += 1
+			self.sums[label] += value
+
+	def time(self, label=None):
+		"""Decorator recording how long each call takes"""
+		def decorator(fn):
+			@functools.wraps(fn)
+			def timed(*args, **kwargs):
+				start = time.time()
+				try:
+					return fn(*args, **kwargs)
+				finally:
+					self.observe(time.time() - start, label)
+			return timed
+		return decorator
+
+	def render(self):
+		lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+		with self.lock:
+			snapshot = [(label, list(counts), self.sums[label]) for label, counts in self.counts.items()]
+		for label, counts, total in sorted(snapshot):
+			cumulative = 0
+			for le, count in zip(self.buckets + [float('inf')], counts):
+				cumulative += count
+				lines.append('%s_bucket%s %d' % (self.name, formatLabels(self.labelName, label, 'le="%s"' % formatValue(le)), cumulative))
+			lines.append('%s_sum%s %s' % (self.name, formatLabels(self.labelName, label), formatValue(total)))
+			lines.append('%s_count%s %d' % (self.name, formatLabels(self.labelName, label), cumulative))
+		return lines
+
+class Registry:
+	def __init__(self):
+		self.metrics = []
+
+	def add(self, metric):
+		self.metrics.append(metric)
+		return metric
+
+	def counter(self, name, help, labelName=None):
+		return self.add(Counter(name, help, labelName))
+
+	def gauge(self, name, help, callback):
+		return self.add(Gauge(name, help, callback))
+
+	def histogram(self, name, help, labelName=None, buckets=DEFAULT_BUCKETS):
+		return self.add(Histogram(name, help, labelName, buckets))
+
+	def render(self):
+		"""Every metric in the Prometheus text exposition format"""
+		lines = []
+		for metric in self.metrics:
+			lines.extend(metric.render())
+		return '\n'.join(lines) + '\n'
+
+registry = Registry() # The process wide registry /metrics serves
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compiled model artifact for the chatbot.
+
+Parsing movies.txt and ratings.txt, running the aka / phrase regexes, stemming
+the sentiment lexicon, building the title index, finding every movie's
+nearest neighbors and factorizing the ratings takes a while, and every worker
+used to do it on boot. compileModel does it once and saveModel writes the
+result to a single versioned .npz. loadModel reads it back and rebuilds it
+first if the format version, the index, neighbor or factorization parameters
+or any of the source files changed. Processes that find it stale at the same
+time (the workers of a fresh dyno) take turns on a lock file, so only the
+first one compiles and the others read what it wrote.
+
+Given a database URL the data comes from the tables moviedb loads instead of
+the files, and the artifact is rebuilt when a different dataset is loaded.
+
+Run `python src/modelcache.py` from the repository root to rebuild it by hand,
+MOVIE_DATABASE_URL picks the database. Deploys run it at build time (see
+bin/post_compile), so the artifact ships in the slug and dynos boot with it.
+"""
+
+import csv
+import fcntl
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+from movielens import RatingsMatrix, parseTitle, ratings
+from factorization import factorize
+from neighbors import computeNeighbors
+from PorterStemmer import PorterStemmer
+from titleindex import TitleIndex
+
+FORMAT_VERSION = 4
+ARTIFACT_FILENAME = 'data/model.npz'
+SOURCE_FILENAMES = ['data/movies.txt', 'data/ratings.txt', 'data/sentiment.txt']
+NEIGHBOR_COUNT = 50 # Most similar movies kept per movie, see neighbors.computeNeighbors
+NEIGHBOR_SHRINKAGE = 10.0
+FACTOR_RANK = 20 # Latent factors per movie, see factorization.factorize
+FACTOR_REGULARIZATION = 0.1
+FACTOR_ITERATIONS = 10
+FACTOR_PRIOR_COUNT = 20.0
+
+class MovieRecord:
+	"""Plain movie row, the Chatbot turns these into Movie objects"""
+	def __init__(self, id, name, year, genres, titles):
+		self.id = id
+		self.name = name
+		self.year = year
+		self.genres = genres
+		self.titles = titles
+
+def fingerprint(editLimit, regexDiff, engine=None):
+	"""Identifies the inputs an artifact was compiled from, the data files or the database's dataset"""
+	digest = hashlib.sha1()
+	digest.update('%d;%d;%d;%d;%r;%d;%r;%d;%r;' % (FORMAT_VERSION, editLimit, regexDiff, NEIGHBOR_COUNT,
+		NEIGHBOR_SHRINKAGE, FACTOR_RANK, FACTOR_REGULARIZATION, FACTOR_ITERATIONS, FACTOR_PRIOR_COUNT))
+	if engine is not None:
+		import moviedb
+		dataset = moviedb.getFingerprint(engine)
+		if dataset is None:
+			raise ValueError('No MovieLens data in the database, load it with python src/moviedb.py')
+		digest.update('database;' + dataset)
+		return digest.hexdigest()
+	for filename in SOURCE_FILENAMES:
+		with open(filename, 'rb') as f:
+			digest.update(f.read())
+	return digest.hexdigest()
+
+def noProgress(stage):
+	pass
+
+def compileModel(editLimit, regexDiff, engine=None, progress=noProgress):
+	"""Parses the data files (or reads the database), returns (movies, sentiment, ratings, titleIndex, neighbors, factors)
+
+	progress(stage) is called with what it's doing as it goes"""
+	progress('reading movie data')
+	if engine is None:
+		title_list, mat = ratings()
+		lexicon = dict(csv.reader(open('data/sentiment.txt', 'rb')))
+	else:
+		import moviedb
+		title_list, mat, lexicon = moviedb.readData(engine)
+	movies = []
+	for i, (raw_title, genres) in enumerate(title_list):
+		title, year, titleList = parseTitle(raw_title)
+		movies.append(MovieRecord(i, title.strip(), year, genres, titleList))
+
+	stemmer = PorterStemmer()
+	sentiment = dict()
+	for k, v in lexicon.iteritems():
+		sentiment[stemmer.stem(k)] = v
+
+	progress('computing movie neighbors')
+	neighbors = computeNeighbors(mat, NEIGHBOR_COUNT, NEIGHBOR_SHRINKAGE)
+	progress('factorizing ratings')
+	factors = factorize(mat, FACTOR_RANK, FACTOR_REGULARIZATION, FACTOR_ITERATIONS, FACTOR_PRIOR_COUNT)
+	progress('indexing titles')
+	return movies, sentiment, mat, TitleIndex(movies, editLimit, regexDiff), neighbors, factors
+
+def saveModel(filename, key, movies, sentiment, mat, titleIndex, neighbors, factors):
+	arrays = {
+		'version': np.array(FORMAT_VERSION),
+		'fingerprint': np.array(key),
+		'movieNames': np.array([m.name for m in movies], dtype=str),
+		'movieYears': np.array([m.year or '' for m in movies], dtype=str),
+		'movieGenres': np.array([m.genres for m in movies], dtype=str),
+		'titleIndptr': np.cumsum([0] + [len(m.titles) for m in movies]).astype(np.int32),
+		'titles': np.array([t for m in movies for t in m.titles], dtype=str),
+		'sentimentWords': np.array(sentiment.keys(), dtype=str),
+		'sentimentLabels': np.array(sentiment.values(), dtype=str),
+		'ratingsShape': np.array(mat.shape, dtype=np.int32),
+		'ratingsIndptr': mat.indptr,
+		'ratingsIndices': mat.indices,
+		'ratingsData': mat.data,
+		'neighborIds': neighbors[0],
+		'neighborSims': neighbors[1],
+		'globalMean': np.array(factors[0]),
+		'itemBiases': factors[1],
+		'itemFactors': factors[2],
+	}
+	for name, value in titleIndex.getState().iteritems():
+		arrays['index_' + name] = value
+
+	# Write to a temporary file and rename, so concurrent workers never see half a file
+	directory = os.path.dirname(os.path.abspath(filename))
+	fd, tmpname = tempfile.mkstemp(dir=directory, suffix='.npz')
+	with os.fdopen(fd, 'wb') as f:
+		np.savez(f, **arrays)
+	os.chmod(tmpname, 0644)
+	os.rename(tmpname, filename)
+
+def openModel(filename, key):
+	"""Returns the artifact's arrays (read when accessed), or None if it is missing or stale"""
+	if not os.path.exists(filename):
+		return None
+	try:
+		data = np.load(filename)
+	except (IOError, ValueError):
+		return None
+	if 'version' not in data or int(data['version']) != FORMAT_VERSION or str(data['fingerprint']) != key:
+		data.close()
+		return None
+	return data
+
+def readModel(filename, key):
+	"""Returns the artifact contents, or None if it is missing or stale"""
+	data = openModel(filename, key)
+	if data is None:
+		return None
+
+	years = data['movieYears'].tolist()
+	genres = data['movieGenres'].tolist()
+	titles = data['titles'].tolist()
+	titleIndptr = data['titleIndptr'].tolist()
+	movies = []
+	for i, name in enumerate(data['movieNames'].tolist()):
+		movies.append(MovieRecord(i, name, years[i] or None, genres[i], titles[titleIndptr[i]:titleIndptr[i + 1]]))
+
+	sentiment = dict(zip(data['sentimentWords'].tolist(), data['sentimentLabels'].tolist()))
+
+	mat = RatingsMatrix(tuple(data['ratingsShape'].tolist()), data['ratingsIndptr'],
+		data['ratingsIndices'], data['ratingsData'])
+
+	titleIndex = TitleIndex.fromState(dict((name[len('index_'):], data[name])
+		for name in data.files if name.startswith('index_')))
+	return movies, sentiment, mat, titleIndex, (data['neighborIds'], data['neighborSims']), \
+		(float(data['globalMean']), data['itemBiases'], data['itemFactors'])
+
+def createEngine(dataUrl):
+	if dataUrl is None:
+		return None
+	from sqlalchemy import create_engine
+	return create_engine(dataUrl)
+
+def isCompiled(editLimit, regexDiff, filename=ARTIFACT_FILENAME, dataUrl=None):
+	"""Whether loadModel would find an up to date artifact, rather than have to compile one"""
+	engine = createEngine(dataUrl)
+	try:
+		data = openModel(filename, fingerprint(editLimit, regexDiff, engine))
+	finally:
+		if engine is not None:
+			engine.dispose()
+	if data is None:
+		return False
+	data.close()
+	return True
+
+def loadModel(editLimit, regexDiff, filename=ARTIFACT_FILENAME, dataUrl=None, progress=noProgress):
+	"""Loads the compiled model, compiling and saving it first if needed, returns (fingerprint, model)
+
+	dataUrl is the database to read the data from (see moviedb), None for the files in data/"""
+	engine = createEngine(dataUrl)
+	try:
+		progress('reading compiled model')
+		key = fingerprint(editLimit, regexDiff, engine)
+		model = readModel(filename, key)
+		if model is None:
+			progress('waiting for another process compiling the model')
+			with open(filename + '.lock', 'a') as lock:
+				# Released when the file is closed. Unlike flock, a process forked meanwhile doesn't inherit it
+				fcntl.lockf(lock, fcntl.LOCK_EX)
+				model = readModel(filename, key) # Whoever held the lock may have just written it
+				if model is None:
+					model = compileModel(editLimit, regexDiff, engine, progress)
+					saveModel(filename, key, *model)
+	finally:
+		if engine is not None:
+			engine.dispose() # Don't hand pooled connections down to forked workers
+	return key, model
+
+if __name__ == '__main__':
+	from chatbot import Chatbot
+	if os.path.exists(ARTIFACT_FILENAME):
+		os.remove(ARTIFACT_FILENAME)
+	Chatbot(dataUrl=os.environ.get('MOVIE_DATABASE_URL')) # Compiles with the chatbot's own EDIT_LIMIT and REGEX_DIFF
+	print 'Wrote %s' % ARTIFACT_FILENAME
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+The MovieLens data (movies, ratings and the sentiment lexicon) in a database.
+
+Every dyno used to parse the flat files in data/ that ship with the slug.
+loadFiles ingests them into indexed tables once, so the dataset can be
+updated centrally: point MOVIE_DATABASE_URL at the database and the model
+is compiled from it (see modelcache.compileModel), in one large streaming
+query per table. The dataset table records a fingerprint of what was loaded,
+which modelcache uses to tell whether its compiled artifact is stale, so
+workers only read the tables when the data changed.
+
+On Postgres rows go in with COPY, elsewhere (e.g. SQLite for local runs)
+with batched executemany. The tables live in their own MetaData, outside of
+the Flask app's models, so loading doesn't need the app or a movie model.
+
+Run `python src/moviedb.py [database url]` from the repository root to load
+the files into DATABASE_URL (or the given database), replacing what's there.
+"""
+
+import collections
+import csv
+import hashlib
+import os
+import sys
+from cStringIO import StringIO
+from datetime import datetime
+
+import numpy as np
+from movielens import RatingsMatrix, titles
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, MetaData, String, Table, create_engine, select
+
+SOURCE_FILENAMES = ['data/movies.txt', 'data/ratings.txt', 'data/sentiment.txt']
+BATCH_SIZE = 10000 # Rows per executemany, and per fetch when streaming them back
+
+metadata = MetaData()
+
+movieTable = Table('movielens_movie', metadata,
+	Column('id', Integer, primary_key=True, autoincrement=False),
+	Column('title', String, nullable=False),
+	Column('genres', String, nullable=False))
+
+# The primary key (movie_id, user_id) is the order the ratings matrix is built in
+ratingTable = Table('movielens_rating', metadata,
+	Column('movie_id', Integer, ForeignKey('movielens_movie.id'), primary_key=True, autoincrement=False),
+	Column('user_id', Integer, primary_key=True, autoincrement=False, index=True),
+	Column('rating', Float, nullable=False))
+
+# Words are read back in file order: several stem the same, and the last one stemmed wins
+sentimentTable = Table('movielens_sentiment', metadata,
+	Column('position', Integer, primary_key=True, autoincrement=False),
+	Column('word', String, nullable=False, unique=True),
+	Column('label', String, nullable=False))
+
+datasetTable = Table('movielens_dataset', metadata,
+	Column('id', Integer, primary_key=True),
+	Column('fingerprint', String(40), nullable=False),
+	Column('dateLoaded', DateTime, nullable=False))
+
+def hashFiles(filenames=SOURCE_FILENAMES):
+	digest = hashlib.sha1()
+	for filename in filenames:
+		with open(filename, 'rb') as f:
+			digest.update(f.read())
+	return digest.hexdigest()
+
+def readFiles(moviesFilename, ratingsFilename, sentimentFilename):
+	"""Rows of the three tables, parsed like movielens.ratings and modelcache.compileModel do"""
+	movies = [(i, title, genres) for i, (title, genres) in enumerate(titles(moviesFilename))]
+	ratings = dict() # Later duplicates win, like RatingsMatrix.fromTriples
+	for line in csv.reader(open(ratingsFilename, 'rb'), delimiter='%'):
+		ratings[(int(line[1]), int(line[0]))] = float(line[2])
+	ratings = [(movieId, userId, rating) for (movieId, userId), rating in sorted(ratings.iteritems())]
+	# In the order the words first appear, with their last label, so dict(rows) is dict(csv.reader(file))
+	sentiment = collections.OrderedDict(csv.reader(open(sentimentFilename, 'rb')))
+	sentiment = [(i, word, label) for i, (word, label) in enumerate(sentiment.iteritems())]
+	return movies, ratings, sentiment
+
+def insertRows(connection, table, columns, rows):
+	"""Bulk inserts rows, tuples of the columns' values"""
+	if connection.dialect.name == 'postgresql':
+		buffer = StringIO()
+		csv.writer(buffer).writerows(rows)
+		buffer.seek(0)
+		cursor = connection.connection.cursor() # The DBAPI connection, in the same transaction
+		cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (table.name, ', '.join(columns)), buffer)
+		return
+	for start in range(0, len(rows), BATCH_SIZE):
+		connection.execute(table.insert(), [dict(zip(columns, [value.decode('utf-8') if isinstance(value, str) else value
+			for value in row])) for row in rows[start:start + BATCH_SIZE]])
+
+def loadFiles(engine, filenames=SOURCE_FILENAMES):
+	"""Replaces the MovieLens tables' contents with the flat files, returns their fingerprint"""
+	movies, ratings, sentiment = readFiles(*filenames)
+	key = hashFiles(filenames)
+	metadata.create_all(engine)
+	with engine.begin() as connection: # Readers see the old dataset or the new one, never half of it
+		for table in [datasetTable, ratingTable, sentimentTable, movieTable]:
+			connection.execute(table.delete())
+		insertRows(connection, movieTable, ['id', 'title', 'genres'], movies)
+		insertRows(connection, ratingTable, ['movie_id', 'user_id', 'rating'], ratings)
+		insertRows(connection, sentimentTable, ['position', 'word', 'label'], sentiment)
+		connection.execute(datasetTable.insert(), {'fingerprint': key, 'dateLoaded': datetime.utcnow()})
+	return key
+
+def getFingerprint(engine):
+	"""Fingerprint of the loaded dataset, None if nothing was loaded"""
+	if not engine.has_table(datasetTable.name):
+		return None
+	return engine.execute(select([datasetTable.c.fingerprint]).order_by(datasetTable.c.id.desc()).limit(1)).scalar()
+
+def toBytes(value):
+	"""The files are read as UTF-8 byte strings, and so is everything that reads the model"""
+	return value.encode('utf-8') if isinstance(value, unicode) else value
+
+def streamRows(connection, query):
+	"""Rows of the query, fetched BATCH_SIZE at a time (from a server side cursor where supported)"""
+	result = connection.execution_options(stream_results=True).execute(query)
+	while True:
+		rows = result.fetchmany(BATCH_SIZE)
+		if not rows:
+			break
+		for row in rows:
+			yield row
+
+def readData(engine):
+	"""(title_list, ratings matrix, lexicon), what movielens.ratings and data/sentiment.txt give"""
+	with engine.connect() as connection:
+		title_list = [[toBytes(title), toBytes(genres)] for id, title, genres in
+			streamRows(connection, select([movieTable]).order_by(movieTable.c.id))]
+
+		movieIds, userIds, values = [], [], []
+		query = select([ratingTable.c.movie_id, ratingTable.c.user_id, ratingTable.c.rating]) \
+			.order_by(ratingTable.c.movie_id, ratingTable.c.user_id)
+		for movieId, userId, rating in streamRows(connection, query):
+			movieIds.append(movieId)
+			userIds.append(userId)
+			values.append(rating)
+		# Users are the matrix's columns: ids from 1, or with gaps, are numbered from 0 in order
+		users, userIndexes = np.unique(np.array(userIds, dtype=np.int32), return_inverse=True)
+		mat = RatingsMatrix.fromTriples(np.array(movieIds, dtype=np.int32), userIndexes.astype(np.int32),
+			np.array(values), (len(title_list), len(users)))
+
+		query = select([sentimentTable.c.word, sentimentTable.c.label]).order_by(sentimentTable.c.position)
+		lexicon = dict((toBytes(word), toBytes(label)) for word, label in streamRows(connection, query))
+	return title_list, mat, lexicon
+
+if __name__ == '__main__':
+	url = sys.argv[1] if len(sys.argv) > 1 else os.environ['DATABASE_URL']
+	print 'Loaded MovieLens data %s' % loadFiles(create_engine(url))
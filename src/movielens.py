@@ -7,24 +7,96 @@
 
 
 import csv
+import re
 import numpy as np
 
+class RatingsMatrix:
+	"""
+	Sparse num_movies x num_users ratings matrix in compressed sparse row form.
+	Row i holds the ratings for movie i, ratings are stored as int8 in half
+	star steps (rating * SCALE), unrated entries aren't stored at all.
+	"""
+	SCALE = 2.0
+
+	def __init__(self, shape, indptr, indices, data):
+		self.shape = shape
+		self.indptr = indptr
+		self.indices = indices
+		self.data = data
+		self.rows = np.repeat(np.arange(shape[0], dtype=np.int32), np.diff(indptr))
+
+	@classmethod
+	def fromTriples(cls, movie_ids, user_ids, values, shape):
+		"""Builds the matrix from parallel arrays, later duplicates win"""
+		# Out of range ids would wrap around into another movie's row
+		for name, ids, size in [('movie', movie_ids, shape[0]), ('user', user_ids, shape[1])]:
+			if len(ids) > 0 and (ids.min() < 0 or ids.max() >= size):
+				raise IndexError('%s ids %d to %d out of range for %d %ss' % (name, ids.min(), ids.max(), size, name))
+		keys = movie_ids.astype(np.int64) * shape[1] + user_ids
+		keys, last = np.unique(keys[::-1], return_index=True)
+		values = values[::-1][last]
+		movie_ids = (keys // shape[1]).astype(np.int32)
+		indices = (keys % shape[1]).astype(np.int32)
+		indptr = np.zeros(shape[0] + 1, dtype=np.int32)
+		np.cumsum(np.bincount(movie_ids, minlength=shape[0]), out=indptr[1:])
+		data = np.round(values * cls.SCALE).astype(np.int8)
+		return cls(shape, indptr, indices, data)
+
+	def __len__(self):
+		return self.shape[0]
+
+	@property
+	def nnz(self):
+		return len(self.data)
+
+	def values(self):
+		"""Stored ratings as floats, aligned with self.rows and self.indices"""
+		return self.data / self.SCALE
+
+	def row(self, i):
+		"""(user indices, ratings) of everyone who rated movie i"""
+		start, end = self.indptr[i], self.indptr[i + 1]
+		return self.indices[start:end], self.data[start:end] / self.SCALE
+
+	def dot(self, vec):
+		"""Matrix times a per-user vector, gives a per-movie vector"""
+		return np.bincount(self.rows, weights=self.values() * vec[self.indices], minlength=self.shape[0])
+
+	def tdot(self, vec):
+		"""Transpose times a per-movie vector, gives a per-user vector"""
+		return np.bincount(self.indices, weights=self.values() * vec[self.rows], minlength=self.shape[1])
+
+	def rowSums(self, values=None):
+		return np.bincount(self.rows, weights=self.values() if values is None else values, minlength=self.shape[0])
+
+	def colSums(self, values=None):
+		return np.bincount(self.indices, weights=self.values() if values is None else values, minlength=self.shape[1])
+
+	def toarray(self):
+		mat = np.zeros(self.shape)
+		mat[self.rows, self.indices] = self.values()
+		return mat
+
+	def binarize(self, DIVIDER=3.0):
+		"""Stored ratings above DIVIDER become 1, the rest -1. Unrated stays 0."""
+		positive = self.data > DIVIDER * self.SCALE
+		self.data[positive] = self.SCALE
+		self.data[~positive] = -self.SCALE
+
 def ratings(src_filename='data/ratings.txt', delimiter='%', header=False, quoting=csv.QUOTE_MINIMAL):
 	title_list = titles()
-	user_id_set = set()
-	with open(src_filename, 'r') as f:
-	    content = f.readlines()
-	    for line in content:
-	        user_id = int(line.split(delimiter)[0])
-	        if user_id not in user_id_set:
-	            user_id_set.add(user_id)
-	num_users = len(user_id_set)
-	num_movies = len(title_list)
-	mat = np.zeros((num_movies, num_users))
-
-	reader = csv.reader(file(src_filename), delimiter=delimiter, quoting=quoting)
+	user_ids = []
+	movie_ids = []
+	values = []
+	reader = csv.reader(open(src_filename, 'rb'), delimiter=delimiter, quoting=quoting)
 	for line in reader:
-		mat[int(line[1])][int(line[0])] = float(line[2])
+		user_ids.append(int(line[0]))
+		movie_ids.append(int(line[1]))
+		values.append(float(line[2]))
+	num_users = len(set(user_ids))
+	num_movies = len(title_list)
+	mat = RatingsMatrix.fromTriples(np.array(movie_ids, dtype=np.int32), np.array(user_ids, dtype=np.int32),
+		np.array(values), (num_movies, num_users))
 	return title_list, mat
 
 def titles(src_filename='data/movies.txt', delimiter='%', header=False, quoting=csv.QUOTE_MINIMAL):
@@ -36,3 +108,58 @@ def titles(src_filename='data/movies.txt', delimiter='%', header=False, quoting=
 			title = title[1:-1]
 		title_list.append([title, genres])
 	return title_list
+
+def getTitleAndPhrasesFromTempTitle(temp_title):
+	title = ""
+	phrases = []
+	reading = True
+	curPhrase = ""
+	for c in temp_title:
+		if c == '(':
+			reading = False
+		elif c == ')':
+			reading = True
+		elif reading:
+			title += c
+			if c == ',':
+				phrases.append(curPhrase.strip())
+				curPhrase = ""
+			else:
+				curPhrase += c
+	if len(curPhrase.strip()) > 0:
+		phrases.append(curPhrase.strip())
+	return (title, phrases)
+
+def getTitlesFromPhraseList(phrases):
+	buildTitle = ""
+	titleList = []
+	for phrase in phrases:
+		if phrase in ["The", "A", "An", "Le", "La", "Les", "L'"]:
+			buildTitle = phrase + " " + buildTitle
+			titleList.append(buildTitle)
+		else:
+			buildTitle = buildTitle + (", " if len(buildTitle) > 0 else "") + phrase
+			titleList.append(buildTitle)
+	return titleList
+
+def parseTitle(raw_title):
+	"""Splits a movies.txt title into (title, year, list of aliases)"""
+	temp_title = raw_title
+	year = None
+	if raw_title[-1] == ')':
+		temp_title = temp_title[:-7]
+		year = raw_title[-5:-1]
+
+	title, phrases = getTitleAndPhrasesFromTempTitle(temp_title)
+	titleList = getTitlesFromPhraseList(phrases)
+
+	akaPattern = "\(a.k.a. (.*?)\)"
+
+	matches = re.findall(akaPattern, temp_title)
+	if len(matches) == 0:
+		akaPattern = "\(([^\d]+?)\)"
+		matches = re.findall(akaPattern, temp_title)
+	for match in matches:
+		_, phrases = getTitleAndPhrasesFromTempTitle(match)
+		titleList.extend(getTitlesFromPhraseList(phrases))
+	return title, year, titleList
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gc
+
+import numpy as np
+import modelcache
+from sentiment import SentimentEngine
+
+class Movie(object): # New style, hashing old style instances is slow for our big dicts
+	# No per instance __dict__: the objects stay small and packed together, so
+	# the reference counting of recommendation dicts dirties fewer shared pages
+	__slots__ = ['movieName', 'titles', 'year', 'genres', 'id']
+
+	def __init__(self, name = "", year = "", gens = ""):
+		self.movieName = name.strip()
+		self.titles = [self.movieName]
+		self.year = year
+		self.genres = set(gens.split("|"))
+		self.id = 0
+
+	def printMovie(self):
+		return self.titles[0]# + " from " + self.year
+
+	def recoPrintMovie(self):
+		if self.year is not None and len(self.year) == 4: # Some titles come without a year
+			return "%s (%s)" % (self.titles[0], self.year)
+		return self.printMovie()
+
+	def __str__ (self):
+		return "%s (%s)" % (self.movieName, str(self.year))
+
+"""
+Everything the chatbot knows about movies: titles, genres, the sentiment
+lexicon (and the SentimentEngine scoring with it), the ratings matrix and the statistics precomputed from it.
+
+None of it changes while chatting, so one model is shared by every Chatbot
+in a process (see getSharedModel). Loaded before gunicorn forks its workers
+(--preload), the workers share its pages copy-on-write. freeze() makes the
+numpy arrays read only so nothing writes to those pages by accident. The bulk
+of the model lives in a few numpy arrays rather than many small Python
+objects, so reference counting and the garbage collector touch few pages.
+"""
+class MovieModel:
+	RATING_PRIOR_COUNT = 10 # Pseudo ratings at the global mean when ranking the best movies
+	GENRE_TOP_K = 50
+
+	def __init__(self, editLimit, regexDiff, dataUrl=None, progress=modelcache.noProgress):
+		# The ratings matrix has the following shape: num_movies x num_users
+		# The values stored in each row i and column j is the rating for
+		# movie i by user j
+		# version identifies what the model was built from, see recocache
+		self.version, (movies, self.sentiment, self.ratings, self.titleIndex, neighbors, factors) = \
+			modelcache.loadModel(editLimit, regexDiff, dataUrl=dataUrl, progress=progress)
+		# Row i holds the movies most similar to movie i, see neighbors.computeNeighbors
+		self.neighborIds, self.neighborSims = neighbors
+		# Ratings are about globalMean + itemBiases + itemFactors . user factor, see factorization
+		self.globalMean, self.itemBiases, self.itemFactors = factors
+		self.baselineRatings = self.globalMean + self.itemBiases.astype(np.float64)
+		self.factorRegularization = modelcache.FACTOR_REGULARIZATION
+		self.factorPriorCount = modelcache.FACTOR_PRIOR_COUNT
+		self.sentimentEngine = SentimentEngine(self.sentiment)
+		self.frozen = False
+		self.titles = []
+		self.genreList = set()
+		for record in movies:
+			m = Movie(record.name, record.year, record.genres)
+			self.genreList = self.genreList.union(m.genres)
+			m.id = record.id
+			m.titles = record.titles
+			self.titles.append(m)
+		progress('preparing recommendation statistics')
+		self.prepareGenres()
+		self.prepareCollaborative()
+		self.preparePopularity()
+
+	def getArrays(self):
+		"""Every numpy array the model holds"""
+		arrays = [self.genreMatrix, self.userWeights, self.collaborativeRatings, self.ratingCounts,
+			self.meanRatings, self.dampedRatings, self.bestMovieOrder, self.neighborIds, self.neighborSims,
+			self.itemBiases, self.itemFactors, self.baselineRatings] + self.bestGenreOrder.values()
+		arrays += [self.ratings.indptr, self.ratings.indices, self.ratings.data, self.ratings.rows]
+		arrays += [value for value in vars(self.titleIndex).itervalues() if isinstance(value, np.ndarray)]
+		arrays += [value for value in vars(self.titleIndex.typoIndex).itervalues() if isinstance(value, np.ndarray)]
+		return arrays
+
+	def freeze(self):
+		"""Makes the model read only, call before forking workers"""
+		for array in self.getArrays():
+			array.flags.writeable = False
+		gc.collect()
+		if hasattr(gc, 'freeze'): # Python 3.7+: keep the collector off the shared objects
+			gc.freeze()
+		self.frozen = True
+
+	"""
+	Parameters: DIVIDER (default parameter, not necessary)
+	Returns: None
+
+	Functionality:
+	Converts every rating in our sparse ratings matrix above
+		DIVIDER to 1, and below divider to -1.
+		Thus we are "binarizing" the ratings to a 1 or -1.
+		Movies a user hasn't rated stay unrated (0).
+	"""
+	def binarize(self, DIVIDER = 3.0):
+		"""Modifies the ratings matrix to make all of the ratings binary"""
+		if self.frozen:
+			raise ValueError("Can't binarize a frozen movie model")
+		self.ratings.binarize(DIVIDER)
+		self.version += ';binarized %r' % DIVIDER
+		self.prepareCollaborative()
+		self.preparePopularity()
+
+	def prepareGenres(self):
+		"""Encodes the genres of every movie as a movies x genres 0/1 matrix"""
+		self.genreNames = sorted(self.genreList)
+		self.genreIds = dict((genre, i) for i, genre in enumerate(self.genreNames))
+		self.genreMatrix = np.zeros((len(self.titles), len(self.genreNames)))
+		for movie in self.titles:
+			self.genreMatrix[movie.id, [self.genreIds[genre] for genre in movie.genres]] = 1.0
+
+	def prepareCollaborative(self):
+		"""Precomputes the mean centered user matrix for Chatbot.recommendUserCollaborative"""
+		# The centered matrix is ratings - userSums. We never materialize it:
+		# the entries for unrated movies are all -userSums
+		numMovies, numUsers = self.ratings.shape
+		userSums = self.ratings.colSums()
+		ratedCounts = np.bincount(self.ratings.indices, minlength=numUsers)
+		centeredNorms = self.ratings.colSums(np.abs(self.ratings.values() - userSums[self.ratings.indices])) + \
+			(numMovies - ratedCounts) * np.abs(userSums)
+
+		# Each user's similarity to the query is centeredNorms[u] times the L1 norm
+		# of the query (see Chatbot.distance), which cancels out in the weighted average.
+		# So the predicted ratings are the same for every query: compute them once
+		normSum = centeredNorms.sum()
+		self.userWeights = centeredNorms / normSum if normSum > 0 else np.zeros(numUsers)
+		self.collaborativeRatings = self.ratings.dot(self.userWeights) - np.dot(userSums, self.userWeights)
+
+	def preparePopularity(self):
+		"""Precomputes per movie rating statistics and the best movie rankings"""
+		positive = self.ratings.values()
+		positive[positive < 0.0] = 0.0 # Only positive ratings count, like a binarized "dislike"
+		totals = self.ratings.rowSums(positive)
+		self.ratingCounts = self.ratings.rowSums((positive > 0.0).astype(np.float64))
+		self.meanRatings = totals / np.maximum(self.ratingCounts, 1.0)
+
+		# Damped mean: a movie with a single 5 star rating shouldn't beat one with hundreds of 4.5s
+		globalMean = totals.sum() / max(self.ratingCounts.sum(), 1.0)
+		self.dampedRatings = (totals + self.RATING_PRIOR_COUNT * globalMean) / (self.ratingCounts + self.RATING_PRIOR_COUNT)
+
+		# Stable sort so ties keep movie id order
+		self.bestMovieOrder = np.argsort(-self.dampedRatings, kind='mergesort')
+		self.bestGenreOrder = dict()
+		for genre in self.genreList:
+			inGenre = self.bestMovieOrder[self.genreMatrix[self.bestMovieOrder, self.genreIds[genre]] > 0]
+			self.bestGenreOrder[genre] = inGenre[:self.GENRE_TOP_K]
+
+sharedModels = dict()
+
+def getSharedModel(editLimit, regexDiff, dataUrl=None, progress=modelcache.noProgress):
+	"""The process wide model for these index parameters and data source, loading it on first use
+
+	progress(stage) is told how the loading goes, see warmup"""
+	key = (editLimit, regexDiff, dataUrl)
+	if key not in sharedModels:
+		sharedModels[key] = MovieModel(editLimit, regexDiff, dataUrl, progress)
+	return sharedModels[key]
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+"""
+Item-item neighbor lists, computed offline by modelcache.
+
+Two movies are similar when the same users rate them alike: the adjusted
+cosine of their ratings after subtracting each user's mean rating. Pairs
+that only a handful of users rated both get little weight, the similarity
+is shrunk by common / (common + shrinkage). Only the `count` most similar
+movies with a positive similarity are kept for each movie, as two movies x
+count arrays (ids padded with -1, similarities with 0), so recommending from
+them only touches the rows of the movies a user told us about.
+"""
+def computeNeighbors(mat, count, shrinkage, blockSize=256):
+	numMovies, numUsers = mat.shape
+	count = min(count, max(numMovies - 1, 0))
+	ids = np.full((numMovies, count), -1, dtype=np.int32)
+	sims = np.zeros((numMovies, count), dtype=np.float32)
+	if count == 0:
+		return ids, sims
+
+	ratedCounts = np.bincount(mat.indices, minlength=numUsers)
+	userMeans = mat.colSums() / np.maximum(ratedCounts, 1)
+	centered = mat.values() - userMeans[mat.indices]
+	norms = np.sqrt(mat.rowSums(centered ** 2))
+	norms[norms == 0.0] = 1.0
+
+	# The ratings grouped by user, to find every movie a user rated along with another
+	byUser = np.argsort(mat.indices, kind='mergesort')
+	userIndptr = np.concatenate([[0], np.cumsum(ratedCounts)])
+
+	for start in range(0, numMovies, blockSize):
+		stop = min(start + blockSize, numMovies)
+		rows = np.arange(stop - start)
+
+		# Only users who rated both movies contribute, so instead of multiplying
+		# dense movies x users matrices we walk the co-rated pairs, which are few
+		ratings = np.arange(mat.indptr[start], mat.indptr[stop])
+		users = mat.indices[ratings]
+		pairCounts = ratedCounts[users]
+		total = pairCounts.sum()
+		first = np.repeat(ratings, pairCounts)
+		offsets = np.arange(total) - np.repeat(np.cumsum(pairCounts) - pairCounts, pairCounts)
+		second = byUser[np.repeat(userIndptr[users], pairCounts) + offsets]
+		keys = (mat.rows[first] - start).astype(np.int64) * numMovies + mat.rows[second]
+		size = (stop - start) * numMovies
+		dots = np.bincount(keys, weights=centered[first] * centered[second], minlength=size)
+		common = np.bincount(keys, minlength=size).astype(np.float64)
+
+		block = (dots / np.outer(norms[start:stop], norms).ravel()) * (common / (common + shrinkage))
+		block = block.reshape(stop - start, numMovies)
+		block[rows, rows + start] = 0.0 # A movie isn't its own neighbor
+
+		top = np.argpartition(-block, count - 1, axis=1)[:, :count]
+		topSims = block[rows[:, None], top]
+		order = np.argsort(-topSims, axis=1, kind='mergesort')
+		top = top[rows[:, None], order]
+		topSims = topSims[rows[:, None], order]
+		positive = topSims > 0.0
+		ids[start:stop] = np.where(positive, top, -1)
+		sims[start:stop] = np.where(positive, topSims, 0.0)
+	return ids, sims
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import Queue
+import threading
+import time
+import traceback
+
+"""
+Runs events through a fixed pool of worker threads, one queue per thread.
+
+Every event has a key, and events with the same key always go to the same
+lane, so they are handled one at a time in the order they were submitted.
+Events with different keys run in parallel on up to `lanes` threads.
+
+makeHandler() is called once in each lane thread and returns the callable
+that handles that lane's events, so a lane can own state such as its own
+Chatbot. With batchSize > 1 the handler gets lists of up to batchSize
+events, whatever was waiting in the lane's queue. Queues hold at most
+maxQueue events; submit() waits up to enqueueTimeout for room and then
+drops the event. Threads don't survive a fork, so they are started lazily
+by the process that submits.
+"""
+class EventPipeline:
+	def __init__(self, makeHandler, lanes=4, maxQueue=1000, enqueueTimeout=1.0, name='pipeline', batchSize=1):
+		self.makeHandler = makeHandler
+		self.batchSize = batchSize
+		self.lanes = lanes
+		self.maxQueue = maxQueue
+		self.enqueueTimeout = enqueueTimeout
+		self.name = name
+		self.pid = None
+		self.closed = False
+		self.lock = threading.Lock()
+
+	def start(self):
+		"""Creates the queues and lane threads for this process"""
+		with self.lock:
+			if self.pid == os.getpid():
+				return
+			self.queues = [Queue.Queue(self.maxQueue) for i in range(self.lanes)]
+			for i, queue in enumerate(self.queues):
+				thread = threading.Thread(target=self.run, args=(queue,), name='%s-%d' % (self.name, i))
+				thread.daemon = True
+				thread.start()
+			self.closed = False
+			self.pid = os.getpid()
+
+	def submit(self, key, event):
+		"""Queues an event, returns False if it was dropped"""
+		if self.closed:
+			print '%s: dropped event for %s, shutting down' % (self.name, key)
+			return False
+		self.start()
+		try:
+			self.queues[hash(key) % self.lanes].put(event, timeout=self.enqueueTimeout)
+		except Queue.Full:
+			print '%s: dropped event for %s, queue is full' % (self.name, key)
+			return False
+		return True
+
+	def depth(self):
+		"""Number of events waiting or being handled"""
+		if self.pid != os.getpid():
+			return 0
+		return sum(queue.unfinished_tasks for queue in self.queues)
+
+	def join(self, timeout=None):
+		"""Waits until every queued event has been handled, returns False on timeout"""
+		deadline = None if timeout is None else time.time() + timeout
+		while self.depth() > 0:
+			if deadline is not None and time.time() >= deadline:
+				return False
+			time.sleep(0.05)
+		return True
+
+	def close(self, timeout=None):
+		"""Stops taking new events and drains the queued ones"""
+		self.closed = True
+		return self.join(timeout)
+
+	def run(self, queue):
+		handle = self.makeHandler()
+		while True:
+			events = [queue.get()]
+			while len(events) < self.batchSize:
+				try:
+					events.append(queue.get_nowait())
+				except Queue.Empty:
+					break
+			try:
+				handle(events if self.batchSize > 1 else events[0])
+			except Exception: # Keep the lane alive whatever happens
+				print '%s: failed to handle %d event(s)' % (self.name, len(events))
+				traceback.print_exc()
+			finally:
+				for event in events:
+					queue.task_done()
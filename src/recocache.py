@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import threading
+
+import metrics
+
+lookups = metrics.registry.counter('recommendation_cache_lookups_total',
+	'Recommendation cache lookups by result', 'result')
+
+"""
+Bounded LRU of recommendation results, shared by every Chatbot in a process.
+
+The same starter preferences and the same "recommend the best comedy" come
+up all the time, so results are cached under a digest of everything they
+depend on (see getKey): what was asked, the preferences, the exclusions,
+and the version of the movie model that answered. Preferences and exclusions
+are sorted first, so the order the user mentioned movies in doesn't matter.
+When a model with a different version shows up, the cache drops everything
+it has: a reloaded or binarized model never gets answers from the old one.
+
+Cached numpy arrays are made read only, callers share them.
+"""
+class RecommendationCache:
+	def __init__(self, capacity=128):
+		self.capacity = capacity
+		self.entries = collections.OrderedDict()
+		self.modelVersion = None
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.entries)
+
+	def getKey(self, model, kind, args=(), preferences=(), excludedIds=()):
+		"""Digest of a request: its kind and arguments, the (movie id, sentiment) preferences and excluded movie ids"""
+		digest = hashlib.sha1()
+		digest.update(repr((model.version, kind, tuple(args), sorted(preferences), sorted(set(excludedIds)))))
+		return digest.hexdigest()
+
+	def get(self, model, key, compute):
+		"""The cached result for key, calling compute() and caching what it returns on a miss"""
+		with self.lock:
+			if self.modelVersion != model.version:
+				self.entries.clear()
+				self.modelVersion = model.version
+			value = self.entries.pop(key, None)
+			if value is not None:
+				self.entries[key] = value # Most recently used last
+		if value is not None:
+			lookups.inc('hit')
+			return value
+
+		lookups.inc('miss')
+		value = compute() # Outside the lock, two threads may compute the same thing once
+		if value is None:
+			return None
+		if hasattr(value, 'flags'):
+			value.flags.writeable = False
+		with self.lock:
+			if self.modelVersion == model.version:
+				self.entries[key] = value
+				while len(self.entries) > self.capacity:
+					self.entries.popitem(last=False)
+		return value
+
+cache = RecommendationCache() # The process wide cache
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+
+from PorterStemmer import CachedStemmer
+
+stemmer = CachedStemmer() # Shared by every engine in the process
+
+"""
+Scores the sentiment of chat messages against a stemmed pos / neg lexicon.
+
+Everything that doesn't depend on the message (word lists, the stemmed
+emphasis words, the intensifier patterns) is built once, and what we learn
+about each distinct word (its stem, label and intensifiers) is cached, so
+scoring a message is one pass over its words. score_many scores a batch,
+for going through message logs offline.
+"""
+class SentimentEngine:
+	NO_SENTIMENT = -999 #Sentinel value
+	MULT = 1.2
+	NEGATION_WORDS = set(["though", "although", "scarcely", "barely", "hardly",
+							"nor", "not", "neither", "none", "nobody", "nope", "nah", "never",
+							"shouldnt", "couldnt", "werent", "wasnt", "doesnt", "isnt", "arent", "didnt"
+							"shouldn't", "couldn't", "weren't", "wasn't", "doesn't", "isn't", "aren't", "didn't"])
+	FOCUS_WORDS = set(["but", "however", "although", "therefore", "thus", "hence"])
+	EMPHASIS_WORDS = ["love", "hate", "favorite", "disgusting"]
+	# "very" is listed twice on purpose, it counts double
+	INTENSIFIER_WORDS = ["really", "very", "absolutely", "extremely", "quite", "rather", "terribly", "too", "very"]
+	IGNORED_CHARACTERS = re.compile('[%s]' % re.escape("!@#$%^&*()_+}{][\|;:.,></?"))
+	MAX_CACHED_WORDS = 50000
+
+	def __init__(self, lexicon, stemmer=stemmer):
+		self.lexicon = lexicon
+		self.stemmer = stemmer
+		self.emphasisStems = set(self.stemmer.stem(word) for word in self.EMPHASIS_WORDS)
+		# Stretched out intensifiers count too, e.g. "reaaally"
+		patterns = [''.join(c + '+' for c in word) for word in self.INTENSIFIER_WORDS]
+		self.intensifierPatterns = [re.compile(pattern) for pattern in patterns]
+		self.anyIntensifier = re.compile('|'.join(patterns))
+		self.words = dict()
+
+	def getNonMovieString(self, line):
+		"""The line without quoted movie titles and punctuation"""
+		return self.IGNORED_CHARACTERS.sub('', ''.join(line.split('"')[::2]))
+
+	def getWord(self, lowered):
+		"""(stem, label, isFocus, isEmphasis, intensifierCount) of a lowercased word"""
+		features = self.words.get(lowered)
+		if features is None:
+			stem = self.stemmer.stem(lowered)
+			intensifiers = 0
+			if self.anyIntensifier.search(lowered): # Most words have none, skip checking each pattern
+				intensifiers = sum(1 for pattern in self.intensifierPatterns if pattern.search(lowered))
+			features = (stem, self.lexicon.get(stem, ""), stem in self.FOCUS_WORDS, stem in self.emphasisStems, intensifiers)
+			if len(self.words) >= self.MAX_CACHED_WORDS:
+				self.words = dict()
+			self.words[lowered] = features
+		return features
+
+	"""
+	Parameters:
+	Takes a raw input string.
+
+	Functionality:
+	Stems input string and compares to stemmed lexicon of
+		positive and negative sentiment words.
+		Also adds support for negation words as from Assign3.
+
+	Return Postcondition:
+	Returns NO_SENTIMENT if no input words are attached to any sentiment.
+	Returns > 0 for positive sentiment, higher is more
+	Returns < 0 for negative sentiment, lower is more
+	Returns 0 for equal positive and negative sentiment
+	"""
+	def score(self, input):
+		exclaimCount = (input.count("!") + 1) / 2
+		numPositiveWords = 0
+		numNegativeWords = 0
+		sentimentWordsExist = False
+		currentlyOpposite = False
+		isFocus = 1
+		mult = 1
+
+		for word in self.getNonMovieString(input).split():
+			lowered = word.lower()
+			if lowered in self.NEGATION_WORDS:
+				currentlyOpposite = not currentlyOpposite
+				continue
+			stem, label, focus, emphasis, intensifiers = self.getWord(lowered)
+			isUpper = word.upper() == word
+			if isUpper:
+				mult *= self.MULT
+			if focus:
+				isFocus = self.MULT ** 2
+			if emphasis:
+				mult *= self.MULT
+
+			if (label == "pos" and not currentlyOpposite) or (label == "neg" and currentlyOpposite):
+				numPositiveWords += mult * isFocus
+				sentimentWordsExist = True
+			elif label == "pos" or label == "neg":
+				numNegativeWords += mult * isFocus
+				sentimentWordsExist = True
+
+			# Intensifiers scale the next word
+			mult = 1
+			for i in range(intensifiers):
+				mult *= self.MULT
+				if isUpper:
+					mult *= self.MULT
+
+		return (numPositiveWords - numNegativeWords) * (1 + exclaimCount) if sentimentWordsExist else self.NO_SENTIMENT
+
+	def score_many(self, texts):
+		"""Scores of each of the texts"""
+		return [self.score(text) for text in texts]
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import os
+import threading
+import time
+import traceback
+
+"""
+Conversation state of a single Messenger sender.
+
+Only movie ids are kept, so a session is small, survives a JSON round trip
+and doesn't depend on which process loaded the movie model. The Chatbot
+turns it back into Movie objects, see Chatbot.setSession / getSession.
+"""
+class ChatSession:
+	MAX_PREFERENCES = 100 # Oldest preferences and recommendations are forgotten first
+	MAX_RECOMMENDED = 100
+
+	def __init__(self, state=0, movieQuery="", movieId=None, sentiment=None, potentialMovieIds=None,
+			addedCurrentMovie=False, preferences=None, recommendedMovieIds=None, nextRecommendedIds=None):
+		self.state = state
+		self.movieQuery = movieQuery
+		self.movieId = movieId
+		self.sentiment = sentiment
+		self.potentialMovieIds = potentialMovieIds or []
+		self.addedCurrentMovie = addedCurrentMovie
+		self.preferences = (preferences or [])[-self.MAX_PREFERENCES:] # [movie id, sentiment] pairs, oldest first
+		self.recommendedMovieIds = (recommendedMovieIds or [])[-self.MAX_RECOMMENDED:]
+		self.nextRecommendedIds = (nextRecommendedIds or [])[:self.MAX_RECOMMENDED] # Ranked, best first
+
+	def toDict(self):
+		return {
+			'state': self.state,
+			'movieQuery': self.movieQuery,
+			'movieId': self.movieId,
+			'sentiment': self.sentiment,
+			'potentialMovieIds': self.potentialMovieIds,
+			'addedCurrentMovie': self.addedCurrentMovie,
+			'preferences': [list(pair) for pair in self.preferences],
+			'recommendedMovieIds': self.recommendedMovieIds,
+			'nextRecommendedIds': self.nextRecommendedIds,
+		}
+
+	@classmethod
+	def fromDict(cls, data):
+		return cls(**dict((str(key), value) for key, value in data.iteritems()))
+
+"""
+Bounded LRU of ChatSessions keyed by sender id, with write-behind persistence.
+
+Every stored session has a version, bumped by each save. load(key) returns
+the stored (version, session dict) of a key, or None. save(sessions) stores a
+dict of key -> session dict and returns the new version of each key.
+
+Any worker may get any sender's messages, so get() rechecks the stored
+version of a cached session and reloads it if another worker has saved a
+newer one. A session we changed and haven't saved yet is the newest one we
+know of and is kept. Updated sessions are only marked dirty. They are saved
+in one batch when maxDirty of them pile up, every flushInterval seconds
+(from a timer thread), or when they hold the cache over capacity: only
+clean sessions are evicted. They only stop being dirty once the save went
+through, and only if they weren't put again in the meantime, so a failed
+save is retried on the next flush. Call flush() before shutting down.
+
+The pipeline's lanes share the store, so the lock only guards the cache:
+loads and saves happen outside of it, one save at a time.
+"""
+class SessionStore:
+	def __init__(self, load, save, capacity=1000, maxDirty=50, flushInterval=5.0):
+		self.load = load
+		self.save = save
+		self.capacity = capacity
+		self.maxDirty = maxDirty
+		self.flushInterval = flushInterval
+		self.sessions = collections.OrderedDict()
+		self.versions = dict() # Stored version each cached session was loaded or saved at
+		self.dirty = dict() # Key -> number of the put that made it dirty
+		self.puts = 0
+		self.timerPid = None
+		self.lock = threading.Lock()
+		self.writeLock = threading.Lock() # Saves in the order they were snapshot
+
+	def __len__(self):
+		return len(self.sessions)
+
+	def get(self, key):
+		"""Session of the key, from the cache unless another worker saved a newer one"""
+		with self.lock:
+			session = self.sessions.get(key)
+			if session is not None and key in self.dirty:
+				self.sessions[key] = self.sessions.pop(key) # Most recently used last
+				return session
+
+		stored = self.load(key)
+
+		with self.lock:
+			session = self.sessions.pop(key, None) # Could have been put or saved while we loaded
+			if key not in self.dirty and stored is not None and \
+					(session is None or stored[0] > self.versions.get(key, stored[0] - 1)):
+				self.versions[key] = stored[0]
+				session = ChatSession.fromDict(stored[1])
+			session = session or ChatSession()
+			self.sessions[key] = session
+			overfull = self.evict()
+		if overfull:
+			self.flush(wait=False)
+		return session
+
+	def put(self, key, session):
+		with self.lock:
+			self.startTimer()
+			self.sessions.pop(key, None)
+			self.sessions[key] = session
+			self.puts += 1
+			self.dirty[key] = self.puts
+			overfull = self.evict()
+			full = len(self.dirty) >= self.maxDirty
+		if overfull or full:
+			self.flush(wait=False)
+
+	def evict(self):
+		"""Drops the least recently used clean sessions over capacity, returns whether dirty ones keep it over"""
+		excess = len(self.sessions) - self.capacity
+		if excess <= 0:
+			return False
+		clean = []
+		for key in self.sessions:
+			if len(clean) == excess:
+				break
+			if key not in self.dirty:
+				clean.append(key)
+		for key in clean:
+			del self.sessions[key]
+			self.versions.pop(key, None)
+		return len(self.sessions) > self.capacity
+
+	def flush(self, wait=True):
+		"""Saves every dirty session, returns whether it worked
+
+		With wait=False it gives up (returning False) if another flush is saving.
+		"""
+		if not self.writeLock.acquire(wait):
+			return False
+		try:
+			with self.lock:
+				if len(self.dirty) == 0:
+					return True
+				puts = dict(self.dirty)
+				sessions = dict((key, self.sessions[key]) for key in puts)
+			try:
+				versions = self.save(dict((key, session.toDict()) for key, session in sessions.iteritems()))
+			except Exception:
+				print 'Failed to save %d session(s), will retry' % len(sessions)
+				traceback.print_exc()
+				return False
+			with self.lock:
+				self.versions.update(versions)
+				for key, put in puts.iteritems():
+					if self.dirty.get(key) == put: # Put again while we saved, that one isn't saved yet
+						del self.dirty[key]
+				self.evict()
+			return True
+		finally:
+			self.writeLock.release()
+
+	def startTimer(self):
+		"""Starts the thread flushing every flushInterval seconds in this process"""
+		if self.timerPid == os.getpid(): # Threads don't survive a fork
+			return
+		self.timerPid = os.getpid()
+		thread = threading.Thread(target=self.runTimer, name='sessions-flush')
+		thread.daemon = True
+		thread.start()
+
+	def runTimer(self):
+		while True:
+			time.sleep(self.flushInterval)
+			self.flush()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from typoindex import TypoIndex, findKeys, gatherLists, packLists
+
+"""
+Character trigram inverted index over every title alias in the movie list.
+
+Chatbot.updateFrame compares the query against each alias (and its two
+year-suffixed variants, see Chatbot.getMovieDifference). The index narrows
+that down to the movies which could possibly score within REGEX_DIFF, so the
+expensive regex / edit distance scoring only runs on a handful of titles.
+Typos are answered by a TypoIndex over the lowercased variants instead of
+running levenshteinDistance against every title of a similar length.
+The candidates are a superset of the movies the full scan would accept, which
+keeps frame.potentialMovies identical.
+"""
+class TitleIndex:
+	def __init__(self, movies, editLimit, regexDiff):
+		self.editLimit = editLimit
+		self.regexDiff = regexDiff
+
+		entryMovies = []
+		entryLengths = []
+		postings = dict()
+		variantMovies = dict()
+		for movie in movies:
+			for title in movie.titles:
+				variants = [title]
+				if movie.year != None:
+					variants.append(title + ".*" + movie.year)
+					variants.append(title + ".*(" + movie.year + ")")
+				for variant in variants:
+					entry = len(entryMovies)
+					entryMovies.append(movie.id)
+					entryLengths.append(len(variant))
+					for gram in self.getTrigrams(variant.lower()):
+						postings.setdefault(gram, []).append(entry)
+					variantMovies.setdefault(variant.lower(), []).append(movie.id)
+
+		self.entryMovies = np.array(entryMovies, dtype=np.int32)
+		self.entryLengths = np.array(entryLengths, dtype=np.int32)
+
+		# Postings and per-variant movie ids are flattened, see packLists
+		self.grams, self.gramEntries, self.gramIndptr = packLists(postings)
+		self.variants, self.variantMovieIds, self.variantIndptr = packLists(variantMovies)
+		self.typoIndex = TypoIndex(variantMovies.keys(), editLimit)
+
+	def getState(self):
+		"""Numpy arrays describing the index, see fromState"""
+		state = {
+			'editLimit': np.array(self.editLimit),
+			'regexDiff': np.array(self.regexDiff),
+		}
+		for name in ['entryMovies', 'entryLengths', 'grams', 'gramEntries', 'gramIndptr',
+					'variants', 'variantMovieIds', 'variantIndptr']:
+			state[name] = getattr(self, name)
+		for key, value in self.typoIndex.getState().iteritems():
+			state['typo_' + key] = value
+		return state
+
+	@classmethod
+	def fromState(cls, state):
+		index = cls([], int(state['editLimit']), int(state['regexDiff']))
+		for name in ['entryMovies', 'entryLengths', 'grams', 'gramEntries', 'gramIndptr',
+					'variants', 'variantMovieIds', 'variantIndptr']:
+			setattr(index, name, state[name])
+		index.typoIndex = TypoIndex.fromState(dict((key[len('typo_'):], value)
+			for key, value in state.iteritems() if key.startswith('typo_')))
+		return index
+
+	def getTrigrams(self, s):
+		return set(s[i:i + 3] for i in range(len(s) - 2))
+
+	"""
+	Returns the lowercased words of the query. The scoring pattern matches the
+	escaped words in order (see Chatbot.getMovieDifference), and so does a
+	substring match, so every title that scores contains each of them.
+	"""
+	def getRequiredLiterals(self, query):
+		return [word for word in query.lower().split(' ') if len(word) > 0]
+
+	def countTrigrams(self, grams):
+		"""Number of the given trigrams found in each entry"""
+		entries = gatherLists(self.gramEntries, self.gramIndptr, findKeys(self.grams, list(grams)))
+		return np.bincount(entries, minlength=len(self.entryMovies))
+
+	"""
+	Parameters: The raw movie query from the frame
+
+	Returns:
+	(candidates, typoDistances) where candidates is a sorted array of ids of
+		every movie that may match the query. typoDistances maps each
+		lowercased variant within editLimit edits of the query to its distance.
+	"""
+	def search(self, query):
+		lowered = query.lower()
+		typoDistances = self.typoIndex.lookup(lowered)
+		literals = self.getRequiredLiterals(query)
+
+		matches = np.zeros(len(self.entryMovies), dtype=bool)
+
+		# Substring and regex matches must contain every required literal
+		literalGrams = set()
+		for literal in literals:
+			literalGrams |= self.getTrigrams(literal)
+		withinRegexDiff = self.entryLengths <= len(query) + self.regexDiff
+		if len(literalGrams) > 0:
+			matches |= withinRegexDiff & (self.countTrigrams(literalGrams) == len(literalGrams))
+		else:
+			matches |= withinRegexDiff
+
+		# Long queries match series titles regardless of length
+		if len(query) >= 10:
+			queryGrams = self.getTrigrams(lowered)
+			matches |= self.countTrigrams(queryGrams) == len(queryGrams)
+
+		typoMovies = gatherLists(self.variantMovieIds, self.variantIndptr, findKeys(self.variants, typoDistances.keys()))
+		return np.union1d(self.entryMovies[matches], typoMovies), typoDistances
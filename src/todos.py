@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+from datetime import datetime
+
+"""
+The todo list commands advertised by app.get_tutorial.
+
+parse() recognizes a command without touching the database, so messages
+for the movie bot cost nothing here. run() answers it for one user with a
+few indexed queries (see the TodoItem indexes in app.py): lists are read in
+(user_id, dateCompleted, dateAdded, id) order straight off the composite
+index and cut at LIST_LIMIT items, with the rest counted up to MORE_LIMIT,
+and '$n' fetches the n-th open item with OFFSET / LIMIT instead of loading
+the list. 'search' is a case insensitive
+substring match, which a pg_trgm index serves on Postgres. A user with
+thousands of items gets the same few short queries as a user with three.
+"""
+class TodoCommands:
+	LIST_LIMIT = 20
+	MORE_LIMIT = 100 # The items past LIST_LIMIT are counted up to this many
+	LIST = re.compile(r'^list(\s+complete[d]?)?$', re.IGNORECASE)
+	ADD = re.compile(r'^add\s+(.+)$', re.IGNORECASE | re.DOTALL)
+	SEARCH = re.compile(r'^search\s+(.+)$', re.IGNORECASE | re.DOTALL)
+	ORDINAL = re.compile(r'^\$(\d+)\s+(finish|delete|edit)(?:\s+(.+))?$', re.IGNORECASE | re.DOTALL)
+
+	def __init__(self, db, TodoItem, tutorial):
+		self.db = db
+		self.TodoItem = TodoItem
+		self.tutorial = tutorial
+
+	def parse(self, text):
+		"""(command, argument, ordinal) of a todo command, None if the text isn't one"""
+		text = text.strip()
+		if text.lower() == 'help':
+			return ('help', None, None)
+		match = self.LIST.match(text)
+		if match:
+			return ('list complete' if match.group(1) else 'list', None, None)
+		match = self.ADD.match(text)
+		if match:
+			return ('add', match.group(1).strip(), None)
+		match = self.SEARCH.match(text)
+		if match:
+			return ('search', match.group(1).strip(), None)
+		match = self.ORDINAL.match(text)
+		if match:
+			return (match.group(2).lower(), match.group(3) and match.group(3).strip(), int(match.group(1)))
+		return None
+
+	def run(self, userId, command):
+		"""Carries out a parsed command for the user, returns the reply"""
+		name, argument, ordinal = command
+		if name == 'help':
+			return self.tutorial
+		if name == 'list':
+			return self.formatList(self.getItems(userId, False), 'Your todo list is empty.')
+		if name == 'list complete':
+			return self.formatList(self.getItems(userId, True), "You haven't completed anything yet.", True)
+		if name == 'add':
+			self.db.session.add(self.TodoItem(text=argument, user_id=userId, dateAdded=datetime.utcnow()))
+			self.db.session.commit()
+			return "Added '%s'" % argument
+		if name == 'search':
+			return self.formatList(self.search(userId, argument), "Nothing matches '%s'." % argument, True)
+
+		item = self.getItems(userId, False).offset(ordinal - 1).limit(1).first() if ordinal > 0 else None
+		if item is None:
+			return 'There is no item $%d on your todo list.' % ordinal
+		if name == 'finish':
+			item.dateCompleted = datetime.utcnow()
+			reply = "Finished '%s'" % item.text
+		elif name == 'delete':
+			self.db.session.delete(item)
+			reply = "Deleted '%s'" % item.text
+		elif argument:
+			reply = "Changed '%s' to '%s'" % (item.text, argument)
+			item.text = argument
+		else:
+			return 'What should $%d say? Use $%d edit followed by the new text.' % (ordinal, ordinal)
+		self.db.session.commit()
+		return reply
+
+	def getItems(self, userId, isComplete):
+		"""Query for the user's open (or completed) items, in the order of the composite index"""
+		TodoItem = self.TodoItem
+		completed = TodoItem.dateCompleted != None if isComplete else TodoItem.dateCompleted == None
+		return TodoItem.query.filter(TodoItem.user_id == userId, completed) \
+			.order_by(TodoItem.dateCompleted, TodoItem.dateAdded, TodoItem.id)
+
+	def search(self, userId, text):
+		"""Query for the user's items containing text, open or completed"""
+		TodoItem = self.TodoItem
+		pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+		return TodoItem.query.filter(TodoItem.user_id == userId, TodoItem.text.ilike(pattern, escape='\\')) \
+			.order_by(TodoItem.dateAdded, TodoItem.id)
+
+	def formatList(self, query, empty, showCompleted=False):
+		items = query.limit(self.LIST_LIMIT + 1).all() # One extra tells us whether there are more
+		if len(items) == 0:
+			return empty
+		lines = []
+		for i, item in enumerate(items[:self.LIST_LIMIT]):
+			if showCompleted:
+				lines.append('%s %s' % ('[x]' if item.dateCompleted is not None else '[ ]', item.text))
+			else:
+				lines.append('$%d %s' % (i + 1, item.text))
+		if len(items) > self.LIST_LIMIT:
+			# count() of a limited query counts in a subquery, which stops at the limit
+			more = query.limit(self.LIST_LIMIT + self.MORE_LIMIT + 1).count() - self.LIST_LIMIT
+			if more > self.MORE_LIMIT:
+				lines.append('... and over %d more' % self.MORE_LIMIT)
+			else:
+				lines.append('... and %d more' % more)
+		return '\n'.join(lines)
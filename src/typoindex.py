@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+"""
+Flattens a dict of lists of ints for compact storage.
+
+Returns (keys, values, indptr) as numpy arrays: keys is sorted, and the list
+for keys[k] is values[indptr[k]:indptr[k + 1]]. Use findKeys to look keys up
+without ever building a dict, which keeps loading these from disk cheap.
+"""
+def packLists(lists):
+	keys = sorted(lists)
+	values = np.array([value for key in keys for value in lists[key]], dtype=np.int32)
+	indptr = np.cumsum([0] + [len(lists[key]) for key in keys]).astype(np.int32)
+	return np.array(keys, dtype=str), values, indptr
+
+def findKeys(keys, probes):
+	"""Positions in the sorted keys array of the probes that are present"""
+	if len(keys) == 0 or len(probes) == 0:
+		return np.zeros(0, dtype=np.int64)
+	probes = np.array(probes, dtype=str)
+	positions = np.minimum(np.searchsorted(keys, probes), len(keys) - 1)
+	return positions[keys[positions] == probes]
+
+def gatherLists(values, indptr, positions):
+	"""Concatenation of the packed lists at the given positions"""
+	if len(positions) == 0:
+		return values[:0]
+	return np.concatenate([values[indptr[k]:indptr[k + 1]] for k in positions])
+
+"""
+Typo tolerant lookup of strings within a fixed edit distance of a query.
+
+Each indexed string is cut into (limit + 1) segments. A string within limit
+edits of the query has at least one segment left untouched, and that segment
+shows up in the query no more than limit characters away from where it sits
+in the string. With a limit of 3 the segments are only a few characters
+long, so looking up those substrings of the query still matches hundreds of
+strings. Most of them are thrown out by comparing character counts: an edit
+changes at most one count up and one down, so a string whose counts differ
+from the query's by more than limit in either direction is too far away
+(counts are kept per byte modulo CHAR_BUCKETS, which only loosens the bound).
+The rest are verified with one edit distance computation over all of them at
+once, see getDistances.
+"""
+class TypoIndex:
+	CHAR_BUCKETS = 64
+
+	def __init__(self, strings, limit):
+		self.limit = limit
+		strings = sorted(set(strings))
+		segments = dict()
+		for stringId, s in enumerate(strings):
+			for i, (start, length) in enumerate(self.getSegments(len(s))):
+				segments.setdefault(self.getKey(len(s), i, s[start:start + length]), []).append(stringId)
+		self.strings = np.array(strings, dtype=str)
+		self.keys, self.stringIds, self.indptr = packLists(segments)
+		self.lengths = np.array([len(s) for s in strings], dtype=np.int32)
+		self.charCounts = np.zeros((len(strings), self.CHAR_BUCKETS), dtype=np.uint8)
+		if len(strings) > 0:
+			codes = self.getCodes(self.strings)
+			rows = np.repeat(np.arange(len(strings)), codes.shape[1])[codes.ravel() != 0]
+			np.add.at(self.charCounts, (rows, codes[codes != 0] % self.CHAR_BUCKETS), 1)
+
+	def getState(self):
+		"""Numpy arrays describing the index, see fromState"""
+		return {
+			'limit': np.array(self.limit),
+			'strings': self.strings,
+			'keys': self.keys,
+			'stringIds': self.stringIds,
+			'indptr': self.indptr,
+			'lengths': self.lengths,
+			'charCounts': self.charCounts,
+		}
+
+	@classmethod
+	def fromState(cls, state):
+		index = cls([], int(state['limit']))
+		index.strings = state['strings']
+		index.keys = state['keys']
+		index.stringIds = state['stringIds']
+		index.indptr = state['indptr']
+		index.lengths = state['lengths']
+		index.charCounts = state['charCounts']
+		return index
+
+	def getCodes(self, strings):
+		"""Bytes of a numpy string array as a strings x longest length uint8 matrix, padded with zeros"""
+		return strings.view(np.uint8).reshape(len(strings), strings.dtype.itemsize)
+
+	def getKey(self, length, i, segment):
+		return '%d %d %s' % (length, i, segment)
+
+	def getSegments(self, length):
+		"""(start, length) of each segment for strings of the given length"""
+		count = self.limit + 1
+		short = length / count
+		longCount = length % count
+		segments = []
+		start = 0
+		for i in range(count):
+			segLength = short + (1 if i >= count - longCount else 0)
+			segments.append((start, segLength))
+			start += segLength
+		return segments
+
+	"""
+	Parameters: A string, and a uint8 matrix of candidate strings with their lengths (see getCodes)
+
+	Returns:
+	Levenshtein distance from the query to every candidate. The usual dynamic
+		program runs over the query's characters, each row computed for all
+		the candidates at once. Within a row, insertions make
+		row[j] = min over k <= j of (t[k] + j - k), a running minimum of
+		t[k] - k. Columns past a candidate's length never feed the ones
+		before it, so the zero padding doesn't matter.
+	"""
+	def getDistances(self, query, codes, lengths):
+		columns = np.arange(codes.shape[1] + 1)
+		previous_row = np.tile(columns, (len(codes), 1))
+		for i, c in enumerate(np.frombuffer(query, dtype=np.uint8)):
+			row = np.empty_like(previous_row)
+			row[:, 0] = i + 1
+			row[:, 1:] = np.minimum(previous_row[:, :-1] + (codes != c), previous_row[:, 1:] + 1)
+			previous_row = np.minimum.accumulate(row - columns, axis=1) + columns
+		return previous_row[np.arange(len(codes)), lengths]
+
+	"""
+	Parameters: The query string, compared as is (callers lowercase it)
+
+	Returns:
+	Dict mapping every indexed string within limit edits of the query
+		to its edit distance.
+	"""
+	def lookup(self, query):
+		if isinstance(query, unicode):
+			query = query.encode('utf-8') # The strings are UTF-8 bytes
+		n = len(query)
+		probes = []
+		for length in range(max(0, n - self.limit), n + self.limit + 1):
+			for i, (start, segLength) in enumerate(self.getSegments(length)):
+				first = max(0, start - self.limit)
+				last = min(n - segLength, start + self.limit)
+				for pos in range(first, last + 1):
+					probes.append(self.getKey(length, i, query[pos:pos + segLength]))
+		candidates = np.unique(gatherLists(self.stringIds, self.indptr, findKeys(self.keys, probes)))
+
+		queryCounts = np.bincount(np.frombuffer(query, dtype=np.uint8) % self.CHAR_BUCKETS,
+			minlength=self.CHAR_BUCKETS).astype(np.int16)
+		# Characters in surplus plus characters missing, the larger of the two is
+		# (their sum + the length difference) / 2
+		differences = np.abs(self.charCounts[candidates].astype(np.int16) - queryCounts).sum(axis=1, dtype=np.int32)
+		lengths = self.lengths[candidates]
+		keep = differences + np.abs(lengths - n) <= 2 * self.limit
+		candidates = candidates[keep]
+		if len(candidates) == 0:
+			return dict()
+
+		strings = self.strings[candidates]
+		lengths = lengths[keep]
+		codes = self.getCodes(strings)[:, :lengths.max()]
+		distances = self.getDistances(query, codes, lengths)
+		close = distances <= self.limit
+		return dict(zip(strings[close].tolist(), distances[close].tolist()))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+"""
+What the recommenders need to know about a chat user, kept up to date as
+their preferences arrive instead of recomputed for every recommendation.
+
+Each preference adds its movie's neighbor row to the item-item sums (see
+Chatbot.recommendItemNeighbors) and its factor to the fold-in sums (see
+factorization.foldIn), so a new preference costs O(neighbors + factors^2)
+whatever the number of movies and users. The user-user engine only needs to
+know which movies were rated: its similarities to the other users just scale
+with the user's vector, see MovieModel.prepareCollaborative.
+
+Preferences are only ever added in order. A changed or forgotten preference
+means starting over from an empty profile (see Chatbot.getProfile), which
+replays the same additions, so the sums don't depend on how we got there.
+"""
+class UserProfile:
+	def __init__(self, model):
+		self.model = model
+		numMovies = len(model.titles)
+		rank = model.itemFactors.shape[1]
+		self.preferences = [] # (movie id, sentiment) pairs, in the order they were added
+		self.rated = np.zeros(numMovies, dtype=bool)
+		self.ratedCount = 0
+		self.neighborTotals = np.zeros(numMovies) # Sum of sentiment * similarity over the user's movies
+		self.neighborWeights = np.zeros(numMovies) # Sum of similarity
+		self.factorGram = np.zeros((rank, rank))
+		self.factorRhs = np.zeros(rank)
+
+	def add(self, movieId, sentiment, rating):
+		"""Adds a preference, rating is the sentiment on the 1 to 5 scale (0 if unrated)"""
+		self.preferences.append((movieId, sentiment))
+		if rating != 0.0 and not self.rated[movieId]:
+			self.rated[movieId] = True
+			self.ratedCount += 1
+
+		neighbors = self.model.neighborIds[movieId]
+		valid = neighbors >= 0
+		sims = self.model.neighborSims[movieId][valid].astype(np.float64)
+		self.neighborTotals[neighbors[valid]] += sims * sentiment # A movie's neighbors are distinct
+		self.neighborWeights[neighbors[valid]] += sims
+
+		factor = self.model.itemFactors[movieId].astype(np.float64)
+		self.factorGram += np.outer(factor, factor)
+		self.factorRhs += factor * (rating - self.model.baselineRatings[movieId])
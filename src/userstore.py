@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import threading
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+import metrics
+
+lookups = metrics.registry.counter('user_cache_lookups_total',
+	'Sender id to user id lookups by result', 'result')
+
+"""
+Resolves Messenger sender ids to User ids, creating the User on first contact.
+
+A sender's id never changes once created, so resolved ids are kept in a
+bounded LRU and a sender we've seen recently costs no query at all. A new one
+costs a single upsert: INSERT ... ON CONFLICT DO UPDATE ... RETURNING id on
+Postgres, INSERT OR IGNORE followed by a select in the same transaction on
+SQLite. Two workers meeting the same new sender both get its one row back,
+where select-then-insert had one of them fail on the unique sender_id.
+"""
+class UserStore:
+	def __init__(self, db, User, capacity=10000):
+		self.db = db
+		self.table = User.__table__
+		self.capacity = capacity
+		self.ids = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.ids)
+
+	def get(self, senderId):
+		"""User id of the sender"""
+		with self.lock:
+			userId = self.ids.pop(senderId, None)
+			if userId is not None:
+				self.ids[senderId] = userId # Most recently used last
+		if userId is not None:
+			lookups.inc('hit')
+			return userId
+
+		lookups.inc('miss')
+		userId = self.upsert(senderId)
+		with self.lock:
+			self.ids[senderId] = userId
+			while len(self.ids) > self.capacity:
+				self.ids.popitem(last=False)
+		return userId
+
+	def upsert(self, senderId):
+		"""Id of the sender's User, inserting it if there's none, in one statement where the database allows"""
+		table = self.table
+		session = self.db.session
+		if session.bind.dialect.name == 'postgresql':
+			statement = postgresql.insert(table).values(sender_id=senderId)
+			# DO NOTHING would return no row for an existing sender, a no-op update returns its id
+			statement = statement.on_conflict_do_update(index_elements=[table.c.sender_id],
+				set_={'sender_id': statement.excluded.sender_id}).returning(table.c.id)
+			userId = session.execute(statement).scalar()
+		else:
+			session.execute(table.insert().prefix_with('OR IGNORE', dialect='sqlite').values(sender_id=senderId))
+			userId = session.execute(select([table.c.id]).where(table.c.sender_id == senderId)).scalar()
+		session.commit()
+		return userId
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+import traceback
+
+"""
+Loads something slow, the movie model, in a background thread so the process
+can answer requests in the meantime.
+
+load(progress) does the work, calling progress(stage) as it goes, and
+status() reports the stage and how long it's been loading for the readiness
+endpoint. A failed load stays failed in that process.
+
+In Python 2 a thread can't import anything while another thread is importing
+a module, and numpy, SQLAlchemy and friends import lazily. A load started in
+the background while our module is being imported (gunicorn --preload) gets
+nowhere until the import is over: when the load is known to be quick, pass
+background=False to start() and get it over with.
+
+Threads don't survive a fork. A process forked after the load finished
+(gunicorn --preload) has the result already; one forked while it was still
+loading starts over in its own thread the first time it calls start().
+"""
+class Warmup:
+	def __init__(self, load, name='warmup'):
+		self.load = load
+		self.name = name
+		self.pid = None
+		self.lock = threading.Lock()
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+		self.stage = 'not started'
+		self.started = None
+		self.finished = None
+
+	def start(self, background=True):
+		"""Starts loading in this process, unless it's loading or done already"""
+		if self.pid == os.getpid() or (self.done.is_set() and self.error is None):
+			return
+		with self.lock:
+			if self.pid == os.getpid():
+				return
+			self.done = threading.Event() # The parent's may have been mid set() when we forked
+			self.error = None
+			self.stage = 'starting'
+			self.started = time.time()
+			self.finished = None
+			self.pid = os.getpid()
+			if background:
+				thread = threading.Thread(target=self.run, name=self.name)
+				thread.daemon = True
+				thread.start()
+		if not background:
+			self.run()
+
+	def run(self):
+		try:
+			self.result = self.load(self.report)
+			self.stage = 'ready'
+		except Exception as e:
+			print '%s: failed to load' % self.name
+			traceback.print_exc()
+			self.error = '%s: %s' % (type(e).__name__, e)
+			self.stage = 'failed'
+		self.finished = time.time()
+		self.done.set()
+
+	def report(self, stage):
+		print '%s: %s' % (self.name, stage)
+		self.stage = stage
+
+	def isReady(self):
+		return self.done.is_set() and self.error is None
+
+	def wait(self, timeout=None):
+		"""Starts loading if needed and waits for it, returns whether it's ready"""
+		self.start()
+		self.done.wait(timeout)
+		return self.isReady()
+
+	def get(self):
+		"""The loaded result, waiting for it, raises RuntimeError if loading failed"""
+		if not self.wait():
+			raise RuntimeError('%s failed to load: %s' % (self.name, self.error))
+		return self.result
+
+	def status(self):
+		"""Whether it's ready, what it's doing and for how long it did it"""
+		end = self.finished or time.time()
+		return {
+			'ready': self.isReady(),
+			'stage': self.stage,
+			'seconds': round(end - self.started, 3) if self.started is not None else None,
+			'error': self.error,
+		}
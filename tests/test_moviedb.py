@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests of loading the MovieLens files into a database and reading them back.
+Run from the repository root with `python -m unittest discover tests`.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import moviedb
+from sqlalchemy import create_engine
+
+class MovieDbTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.engine = create_engine('sqlite:///' + os.path.join(self.directory, 'movies.db'))
+
+	def tearDown(self):
+		self.engine.dispose()
+		shutil.rmtree(self.directory)
+
+	def load(self, ratings):
+		"""Loads three movies, the ratings lines and a small lexicon, returns what readData gives"""
+		contents = {
+			'movies.txt': '0%Heat (1995)%Action\n1%Alien (1979)%Horror\n2%Babe (1995)%Children\n',
+			'ratings.txt': ratings,
+			'sentiment.txt': 'good,pos\nbad,neg\n',
+		}
+		filenames = []
+		for name in ['movies.txt', 'ratings.txt', 'sentiment.txt']:
+			filenames.append(os.path.join(self.directory, name))
+			with open(filenames[-1], 'w') as f:
+				f.write(contents[name])
+		moviedb.loadFiles(self.engine, filenames)
+		return moviedb.readData(self.engine)
+
+	def testDenseUserIds(self):
+		title_list, mat, lexicon = self.load('0%0%4.0\n1%2%2.5\n0%1%1.0\n')
+		self.assertEqual(title_list[1], ['Alien (1979)', 'Horror'])
+		self.assertEqual(lexicon, {'good': 'pos', 'bad': 'neg'})
+		self.assertTrue((mat.toarray() == np.array([[4.0, 0.0], [1.0, 0.0], [0.0, 2.5]])).all())
+
+	def testSparseUserIds(self):
+		# MovieLens releases number their users from 1, deleted users leave gaps
+		title_list, mat, lexicon = self.load('1%0%4.0\n7%1%3.0\n1%2%2.5\n3%0%5.0\n')
+		self.assertEqual(mat.shape, (3, 3))
+		self.assertTrue((mat.toarray() == np.array([[4.0, 5.0, 0.0], [0.0, 0.0, 3.0], [2.5, 0.0, 0.0]])).all())
+
+if __name__ == '__main__':
+	unittest.main()
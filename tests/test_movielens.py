@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the sparse RatingsMatrix. Run from the repository root with
+`python -m unittest discover tests`.
+"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from movielens import RatingsMatrix
+
+class RatingsMatrixTest(unittest.TestCase):
+	def fromTriples(self, movieIds, userIds, values, shape):
+		return RatingsMatrix.fromTriples(np.array(movieIds, dtype=np.int32), np.array(userIds, dtype=np.int32),
+			np.array(values), shape)
+
+	def testMatchesDenseAssignment(self):
+		movieIds, userIds, values = [0, 2, 1, 2, 0], [1, 0, 2, 0, 1], [3.0, 4.5, 1.0, 2.0, 0.5]
+		mat = self.fromTriples(movieIds, userIds, values, (3, 3))
+		dense = np.zeros((3, 3))
+		for movieId, userId, value in zip(movieIds, userIds, values):
+			dense[movieId][userId] = value # Later duplicates win
+		self.assertTrue((mat.toarray() == dense).all())
+		self.assertEqual(mat.nnz, 3)
+
+	def testUserIdOutOfRange(self):
+		# User 2 used to land on movie 1's user 0
+		self.assertRaises(IndexError, self.fromTriples, [0, 0], [1, 2], [4.0, 5.0], (2, 2))
+
+	def testMovieIdOutOfRange(self):
+		self.assertRaises(IndexError, self.fromTriples, [0, 2], [0, 1], [4.0, 5.0], (2, 2))
+
+	def testNegativeId(self):
+		self.assertRaises(IndexError, self.fromTriples, [0, 1], [-1, 1], [4.0, 5.0], (2, 2))
+
+	def testEmpty(self):
+		mat = self.fromTriples([], [], [], (2, 3))
+		self.assertEqual(mat.nnz, 0)
+		self.assertEqual(list(mat.indptr), [0, 0, 0])
+
+if __name__ == '__main__':
+	unittest.main()
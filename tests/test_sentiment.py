@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that SentimentEngine scores exactly like the chatbot's original
+retrieveSentiment, kept here as it was. Run from the repository root with
+`python -m unittest discover tests`.
+"""
+
+import collections
+import csv
+import os
+import random
+import re
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from PorterStemmer import PorterStemmer
+from sentiment import SentimentEngine
+
+NO_SENTIMENT = -999
+
+class BaselineSentiment:
+	"""The original Chatbot.getNonMovieString and retrieveSentiment"""
+	def __init__(self, sentiment):
+		self.stemmer = PorterStemmer()
+		self.sentiment = sentiment
+
+	def getNonMovieString(self, line):
+		out = ""
+		depth = 0
+		for c in line:
+			if c == '"':
+				depth = 1 - depth
+			elif depth == 0:
+				if c not in "!@#$%^&*()_+}{][\|;:.,></?":
+					out += c
+		return out
+
+	def retrieveSentiment(self, input):
+		exclaimCount = (input.count("!") + 1) / 2
+
+		splitInput = self.getNonMovieString(input).split()
+
+		negationIndexes = set()
+		for i, word in enumerate(splitInput):
+			if word.lower() in ["though", "although", "scarcely", "barely", "hardly",
+									"nor", "not", "neither", "none", "nobody", "nope", "nah", "never",
+									"shouldnt", "couldnt", "werent", "wasnt", "doesnt", "isnt", "arent", "didnt"
+									"shouldn't", "couldn't", "weren't", "wasn't", "doesn't", "isn't", "aren't", "didn't"]:
+				negationIndexes.add(i)
+
+		def exagerrate(exg):
+			w = ""
+			for c in exg:
+				w += c + '+'
+			return w
+
+		exagerrationWords = ["really", "very", "absolutely", "extremely", "quite", "rather", "terribly", "too", "very"]
+		exagerrationPatterns = [exagerrate(exg) for exg in exagerrationWords]
+		stemmedInput = [self.stemmer.stem(x.lower()) for x in splitInput]
+		numPositiveWords = 0
+		numNegativeWords = 0
+		sentimentWordsExist = False
+		currentlyOpposite = False
+		sentiWords = [self.stemmer.stem(x) for x in ["love", "hate", "favorite", "disgusting"]]
+		focusWords = ["but", "however", "although", "therefore", "thus", "hence"]
+		isFocus = 1
+		mult = 1
+
+		MULT = 1.2
+		for i, w in enumerate(stemmedInput):
+			if i in negationIndexes:
+				currentlyOpposite = not currentlyOpposite
+				continue
+			word = splitInput[i]
+			if word.upper() == word:
+				mult *= MULT
+			if w in focusWords:
+				isFocus = MULT ** 2
+			if w in sentiWords:
+				mult *= MULT
+
+			if (self.sentiment[w] == "pos" and not currentlyOpposite) or (self.sentiment[w] == "neg" and currentlyOpposite):
+				numPositiveWords += mult * isFocus
+				sentimentWordsExist = True
+			if (self.sentiment[w] == "pos" and currentlyOpposite) or (self.sentiment[w] == "neg" and not currentlyOpposite):
+				numNegativeWords += mult * isFocus
+				sentimentWordsExist = True
+
+			mult = 1
+			for pattern in exagerrationPatterns:
+				if len(re.findall(pattern, word.lower())) > 0:
+					mult *= MULT
+					if word.upper() == word:
+						mult *= MULT
+
+		return (numPositiveWords - numNegativeWords) * (1 + exclaimCount) if sentimentWordsExist else NO_SENTIMENT
+
+def setUpModule():
+	global engine, baseline, lexiconWords
+	# Stemmed the way the chatbot always has, the last word with a stem wins
+	lexicon = dict(csv.reader(open(os.path.join(ROOT, 'data', 'sentiment.txt'), 'rb')))
+	stemmer = PorterStemmer()
+	sentiment = collections.defaultdict(lambda: "")
+	for k, v in lexicon.iteritems():
+		sentiment[stemmer.stem(k)] = v
+	engine = SentimentEngine(dict(sentiment))
+	baseline = BaselineSentiment(sentiment)
+	lexiconWords = sorted(lexicon)
+
+class SentimentTest(unittest.TestCase):
+	def assertSameScores(self, sentences):
+		scores = engine.score_many(sentences)
+		for sentence, score in zip(sentences, scores):
+			self.assertEqual(score, baseline.retrieveSentiment(sentence), repr(sentence))
+			self.assertEqual(engine.score(sentence), score, repr(sentence))
+
+	def testSentences(self):
+		self.assertSameScores([
+			'I loved "Titanic"',
+			'I did not like "Titanic"',
+			"I didn't hate it, not at all",
+			'It was not bad but it was never good',
+			'I REALLY LOVED "Heat"!!!',
+			'It was reaaaally veeery good',
+			'It was very very good, though the ending was terrible',
+			'That was my favorite, however the sequel was disgusting.',
+			'GREAT movie! terrible acting',
+			'nope, nah, I absolutely hated it',
+			'"Love Actually" was fine',
+			'I saw "Good Will Hunting" and "Bad Santa"',
+			'ok',
+			'',
+			'!!!',
+		])
+
+	def testRandomSentences(self):
+		rng = random.Random(13)
+		vocabulary = lexiconWords + list(SentimentEngine.NEGATION_WORDS) + list(SentimentEngine.FOCUS_WORDS) + \
+			SentimentEngine.EMPHASIS_WORDS + SentimentEngine.INTENSIFIER_WORDS + \
+			['reaaally', 'veery', 'tooo', 'loved', 'hated', 'movie', 'the', 'it', 'I', 'was', '"Heat"', 'a']
+		punctuation = ['', '', '', '!', '!!', '.', ',', '?', ':)']
+		sentences = []
+		for i in range(2000):
+			words = []
+			for j in range(rng.randint(1, 12)):
+				word = rng.choice(vocabulary)
+				if rng.random() < 0.15:
+					word = word.upper()
+				elif rng.random() < 0.1:
+					word = word.capitalize()
+				words.append(word + rng.choice(punctuation))
+			sentences.append(' '.join(words))
+		self.assertSameScores(sentences)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the write-behind SessionStore against an in-memory database. Run
+from the repository root with `python -m unittest discover tests`.
+"""
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from sessionstore import ChatSession, SessionStore
+
+class Database:
+	"""load and save for a SessionStore, either can be made to block until released"""
+	def __init__(self):
+		self.rows = dict() # Key -> (version, session dict)
+		self.blockLoads = set()
+		self.blockSaves = False
+		self.failSaves = False
+		self.waiting = threading.Event()
+		self.release = threading.Event()
+
+	def block(self):
+		self.waiting.set()
+		self.release.wait(10)
+
+	def load(self, key):
+		row = self.rows.get(key) # Read before blocking, like a slow query would
+		if key in self.blockLoads:
+			self.block()
+		return row
+
+	def save(self, sessions):
+		if self.blockSaves:
+			self.block()
+		if self.failSaves:
+			raise IOError('database is down')
+		versions = dict()
+		for key, data in sessions.iteritems():
+			versions[key] = self.rows.get(key, (0, None))[0] + 1
+			self.rows[key] = (versions[key], data)
+		return versions
+
+def session(movieQuery):
+	result = ChatSession()
+	result.movieQuery = movieQuery
+	return result
+
+class SessionStoreTest(unittest.TestCase):
+	def setUp(self):
+		self.database = Database()
+		self.store = SessionStore(self.database.load, self.database.save, capacity=2, maxDirty=10,
+			flushInterval=1000)
+
+	def tearDown(self):
+		self.database.release.set()
+
+	def inBackground(self, target):
+		thread = threading.Thread(target=target)
+		thread.daemon = True
+		thread.start()
+		self.assertTrue(self.database.waiting.wait(10))
+		return thread
+
+	def testLoadDoesNotBlockOthers(self):
+		self.database.blockLoads.add('slow')
+		thread = self.inBackground(lambda: self.store.get('slow'))
+		self.store.put('other', session('hi'))
+		self.assertEqual(self.store.get('other').movieQuery, 'hi')
+		self.database.release.set()
+		thread.join(10)
+		self.assertIn('slow', self.store.sessions)
+
+	def testSaveDoesNotBlockOthers(self):
+		self.store.put('a', session('first'))
+		self.database.blockSaves = True
+		thread = self.inBackground(self.store.flush)
+		self.store.put('a', session('second')) # Put while the first one is being saved
+		self.assertEqual(self.store.get('b').movieQuery, '')
+		self.database.blockSaves = False
+		self.database.release.set()
+		thread.join(10)
+		self.assertEqual(self.database.rows['a'][1]['movieQuery'], 'first')
+		self.assertIn('a', self.store.dirty) # The second one is still to be saved
+		self.assertTrue(self.store.flush())
+		self.assertEqual(self.database.rows['a'], (2, session('second').toDict()))
+		self.assertEqual(self.store.dirty, dict())
+
+	def testNewerVersionFromAnotherWorker(self):
+		self.store.put('a', session('ours'))
+		self.store.flush()
+		self.database.rows['a'] = (2, session('theirs').toDict())
+		self.assertEqual(self.store.get('a').movieQuery, 'theirs')
+		self.assertEqual(self.store.versions['a'], 2)
+
+	def testLoadRacingFlush(self):
+		# A get reads version 1 while the session is put and saved as version 2
+		self.store.put('a', session('first'))
+		self.store.flush()
+		self.database.blockLoads.add('a')
+		loaded = []
+		thread = self.inBackground(lambda: loaded.append(self.store.get('a')))
+		self.store.put('a', session('second'))
+		self.assertTrue(self.store.flush())
+		self.database.release.set()
+		thread.join(10)
+		self.assertEqual(loaded[0].movieQuery, 'second')
+		self.assertEqual(self.store.versions['a'], 2)
+
+	def testDirtySessionsAreNotEvicted(self):
+		self.database.failSaves = True
+		for key in ['a', 'b', 'c']:
+			self.store.put(key, session(key))
+		self.assertEqual(len(self.store), 3)
+		self.database.failSaves = False
+		self.assertTrue(self.store.flush())
+		self.assertEqual(len(self.store), 2)
+		self.assertEqual(sorted(self.database.rows), ['a', 'b', 'c'])
+
+	def testFailedSaveStaysDirty(self):
+		self.store.put('a', session('a'))
+		self.database.failSaves = True
+		self.assertFalse(self.store.flush())
+		self.assertIn('a', self.store.dirty)
+		self.database.failSaves = False
+		self.assertTrue(self.store.flush())
+		self.assertEqual(self.store.dirty, dict())
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that the title index only narrows down which movies get scored:
+Chatbot.scoreTitles must give the same scores as scoring every movie with
+levenshteinDistance. Run from the repository root with
+`python -m unittest discover tests`.
+"""
+
+import os
+import random
+import sys
+import unittest
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT) # The data files are read relative to the repository root
+
+from chatbot import Chatbot
+
+class FullScan:
+	"""Stands in for the TitleIndex: every movie is a candidate, no precomputed typo distances"""
+	def __init__(self, count):
+		self.count = count
+
+	def search(self, query):
+		return np.arange(self.count), None
+
+def levenshteinDistance(s1, s2):
+	"""Chatbot.levenshteinDistance, skipping the pairs whose lengths alone put them over EDIT_LIMIT"""
+	if abs(len(s1) - len(s2)) > Chatbot.EDIT_LIMIT:
+		return Chatbot.EDIT_LIMIT + 1
+	return Chatbot.levenshteinDistance.__func__(chatbot, s1, s2)
+
+def setUpModule():
+	global chatbot, titles
+	chatbot = Chatbot()
+	titles = sorted(set(title for movie in chatbot.model.titles for title in movie.titles))
+
+def addTypos(title, count, rng):
+	characters = list(title)
+	for i in range(count):
+		position = rng.randrange(len(characters) + 1)
+		edit = rng.randrange(3)
+		if edit == 0 and position < len(characters):
+			del characters[position]
+		elif edit == 1 or position == len(characters):
+			characters.insert(position, rng.choice('abcdefghijklmnopqrstuvwxyz'))
+		else:
+			characters[position] = rng.choice('abcdefghijklmnopqrstuvwxyz')
+	return ''.join(characters)
+
+class TitleIndexTest(unittest.TestCase):
+	def assertSameScores(self, queries):
+		index = chatbot.model.titleIndex
+		for query in queries:
+			indexed = chatbot.scoreTitles(query)
+			chatbot.model.titleIndex = FullScan(len(chatbot.model.titles))
+			chatbot.levenshteinDistance = levenshteinDistance
+			try:
+				scanned = chatbot.scoreTitles(query)
+			finally:
+				chatbot.model.titleIndex = index
+				del chatbot.levenshteinDistance
+			self.assertEqual(dict((movie.id, dist) for movie, dist in indexed.iteritems()),
+				dict((movie.id, dist) for movie, dist in scanned.iteritems()), repr(query))
+
+	def testSampledTitles(self):
+		rng = random.Random(124)
+		short = [title for title in titles if len(title) <= 16] # The full scan gets slow on long queries
+		queries = rng.sample(short, 3) # Exact
+		queries += [addTypos(title.lower(), rng.randint(1, 3), rng) for title in rng.sample(short, 3)]
+		queries += [title[:rng.randint(3, 16)] for title in rng.sample(titles, 3)] # Prefixes
+		self.assertSameScores(queries)
+
+	def testCommonQueries(self):
+		self.assertSameScores(['titanic', 'Heat', 'godfathr', 'toy'])
+
+	def testRegexMetacharacters(self):
+		self.assertSameScores(['c++', '[rec]', '(500) days', 'what?', 'a|b', 'x\\y', '{3}', 'mr. & mrs.', '*', '.*'])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the todo list commands against an in-memory SQLite database, with
+the same models as app.py. Run from the repository root with
+`python -m unittest discover tests`.
+"""
+
+import os
+import sys
+import unittest
+from datetime import datetime
+
+import flask
+from flask_sqlalchemy import SQLAlchemy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from todos import TodoCommands
+
+app = flask.Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db = SQLAlchemy(app)
+
+class User(db.Model):
+	id = db.Column(db.Integer, primary_key=True)
+	sender_id = db.Column(db.String(80), unique=True)
+
+class TodoItem(db.Model):
+	id = db.Column(db.Integer, primary_key=True)
+	text = db.Column(db.String, nullable=False)
+	dateAdded = db.Column(db.Date, nullable=False)
+	dateCompleted = db.Column(db.Date, nullable=True)
+	user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+class ParseTest(unittest.TestCase):
+	def setUp(self):
+		self.commands = TodoCommands(db, TodoItem, 'tutorial')
+
+	def testCommands(self):
+		parse = self.commands.parse
+		self.assertEqual(parse(' HELP '), ('help', None, None))
+		self.assertEqual(parse('list'), ('list', None, None))
+		self.assertEqual(parse('List Completed'), ('list complete', None, None))
+		self.assertEqual(parse('list complete'), ('list complete', None, None))
+		self.assertEqual(parse('add Buy milk '), ('add', 'Buy milk', None))
+		self.assertEqual(parse('add two\nlines'), ('add', 'two\nlines', None))
+		self.assertEqual(parse('search 100%'), ('search', '100%', None))
+		self.assertEqual(parse('$2 finish'), ('finish', None, 2))
+		self.assertEqual(parse('$12 DELETE'), ('delete', None, 12))
+		self.assertEqual(parse('$1 edit Buy oat milk'), ('edit', 'Buy oat milk', 1))
+		self.assertEqual(parse('$1 edit'), ('edit', None, 1))
+
+	def testNotCommands(self):
+		for text in ['I loved "Titanic"', 'list me a movie like "Heat"', 'add', 'search', '$x finish',
+				'$1 watch', 'helpful', 'recommend a movie']:
+			self.assertEqual(self.commands.parse(text), None, text)
+
+class RunTest(unittest.TestCase):
+	def setUp(self):
+		self.context = app.app_context()
+		self.context.push()
+		db.create_all()
+		self.commands = TodoCommands(db, TodoItem, 'tutorial')
+		db.session.add_all([User(id=1, sender_id='one'), User(id=2, sender_id='two')])
+		db.session.commit()
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.context.pop()
+
+	def reply(self, text, userId=1):
+		return self.commands.run(userId, self.commands.parse(text))
+
+	def addItems(self, count, userId=1):
+		db.session.add_all([TodoItem(text='item %d' % i, user_id=userId, dateAdded=datetime.utcnow())
+			for i in range(count)])
+		db.session.commit()
+
+	def testHelp(self):
+		self.assertEqual(self.reply('help'), 'tutorial')
+
+	def testEmptyLists(self):
+		self.assertEqual(self.reply('list'), 'Your todo list is empty.')
+		self.assertEqual(self.reply('list complete'), "You haven't completed anything yet.")
+		self.assertEqual(self.reply('search milk'), "Nothing matches 'milk'.")
+
+	def testItems(self):
+		self.assertEqual(self.reply('add Buy milk'), "Added 'Buy milk'")
+		self.reply('add Wash the car')
+		self.reply('add Call home')
+		self.reply('add Not mine', userId=2)
+		self.assertEqual(self.reply('list'), '$1 Buy milk\n$2 Wash the car\n$3 Call home')
+		self.assertEqual(self.reply('$2 finish'), "Finished 'Wash the car'")
+		self.assertEqual(self.reply('$1 edit Buy oat milk'), "Changed 'Buy milk' to 'Buy oat milk'")
+		self.assertEqual(self.reply('$2 delete'), "Deleted 'Call home'")
+		self.assertEqual(self.reply('list'), '$1 Buy oat milk')
+		self.assertEqual(self.reply('list complete'), '[x] Wash the car')
+		self.assertEqual(self.reply('list', userId=2), '$1 Not mine')
+
+	def testMissingItem(self):
+		self.reply('add Buy milk')
+		self.assertEqual(self.reply('$2 finish'), 'There is no item $2 on your todo list.')
+		self.assertEqual(self.reply('$0 delete'), 'There is no item $0 on your todo list.')
+		self.assertEqual(self.reply('$1 edit'), 'What should $1 say? Use $1 edit followed by the new text.')
+
+	def testSearchIsLiteral(self):
+		for text in ['100% juice', '100 apples', 'a_b', 'axb', 'back\\slash', 'backslash', 'Orange JUICE']:
+			self.reply('add ' + text)
+		self.reply('$1 finish')
+		self.assertEqual(self.reply('search 100%'), '[x] 100% juice')
+		self.assertEqual(self.reply('search a_b'), '[ ] a_b')
+		self.assertEqual(self.reply('search k\\s'), '[ ] back\\slash')
+		self.assertEqual(self.reply('search juice'), '[x] 100% juice\n[ ] Orange JUICE')
+		self.assertEqual(self.reply('search nothing', userId=2), "Nothing matches 'nothing'.")
+
+	def testListLimit(self):
+		self.addItems(TodoCommands.LIST_LIMIT)
+		self.assertEqual(len(self.reply('list').split('\n')), TodoCommands.LIST_LIMIT)
+		self.addItems(5)
+		lines = self.reply('list').split('\n')
+		self.assertEqual(len(lines), TodoCommands.LIST_LIMIT + 1)
+		self.assertEqual(lines[-1], '... and 5 more')
+
+	def testMoreIsCapped(self):
+		self.addItems(TodoCommands.LIST_LIMIT + TodoCommands.MORE_LIMIT)
+		self.assertEqual(self.reply('list').split('\n')[-1], '... and %d more' % TodoCommands.MORE_LIMIT)
+		self.addItems(1)
+		self.assertEqual(self.reply('list').split('\n')[-1], '... and over %d more' % TodoCommands.MORE_LIMIT)
+		self.addItems(400)
+		self.assertEqual(self.reply('list').split('\n')[-1], '... and over %d more' % TodoCommands.MORE_LIMIT)
+
+if __name__ == '__main__':
+	unittest.main()
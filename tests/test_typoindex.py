@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks TypoIndex.lookup against Chatbot.levenshteinDistance run on every
+indexed string. Run from the repository root with
+`python -m unittest discover tests`.
+"""
+
+import os
+import random
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT) # The data files are read relative to the repository root
+
+from chatbot import Chatbot
+from typoindex import TypoIndex
+
+def setUpModule():
+	global chatbot
+	chatbot = Chatbot()
+
+def bruteForce(strings, query, limit):
+	"""Every string within limit edits of the query, with its distance"""
+	distances = dict()
+	for s in strings:
+		if abs(len(s) - len(query)) <= limit: # Further apart than that on length alone
+			distance = chatbot.levenshteinDistance(s, query)
+			if distance <= limit:
+				distances[s] = distance
+	return distances
+
+def addTypos(s, count, rng, alphabet):
+	characters = list(s)
+	for i in range(count):
+		position = rng.randrange(len(characters) + 1)
+		edit = rng.randrange(3)
+		if edit == 0 and position < len(characters):
+			del characters[position]
+		elif edit == 1 or position == len(characters):
+			characters.insert(position, rng.choice(alphabet))
+		else:
+			characters[position] = rng.choice(alphabet)
+	return ''.join(characters)
+
+class TypoIndexTest(unittest.TestCase):
+	def assertLookups(self, index, strings, queries):
+		for query in queries:
+			self.assertEqual(index.lookup(query), bruteForce(strings, query, index.limit), repr(query))
+
+	def testShortStrings(self):
+		# Strings shorter than limit + 1 have empty segments, which every query contains
+		rng = random.Random(2)
+		alphabet = 'ab c'
+		strings = ['', 'a', 'b', 'ab', 'ba', 'abc', 'aaaa', 'a b', 'abcabc', 'cc', 'c\xc3\xa9']
+		strings += [''.join(rng.choice(alphabet) for i in range(rng.randint(0, 9))) for j in range(200)]
+		for limit in [1, 2, 3]:
+			index = TypoIndex(strings, limit)
+			unique = sorted(set(strings))
+			queries = ['', 'a', 'z', 'zz', 'abcd', 'c\xc3\xa9', 'ce', 'zzzzzzzzzzzzz']
+			queries += [addTypos(s, rng.randint(0, limit + 1), rng, alphabet + 'z') for s in rng.sample(unique, 40)]
+			self.assertLookups(index, unique, queries)
+
+	def testEmptyIndex(self):
+		self.assertEqual(TypoIndex([], 3).lookup('heat'), dict())
+
+	def testTitleVariants(self):
+		rng = random.Random(3)
+		# A sample of the lowercased titles keeps the brute force quick
+		strings = sorted(rng.sample(chatbot.model.titleIndex.typoIndex.strings.tolist(), 3000))
+		index = TypoIndex.fromState(TypoIndex(strings, Chatbot.EDIT_LIMIT).getState())
+		queries = ['', 'a', 'up', 'heat', 'titanic', 'godfathr']
+		queries += [addTypos(s, rng.randint(1, 3), rng, 'abcdefghij ') for s in rng.sample(strings, 12)]
+		self.assertLookups(index, strings, queries)
+
+	def testUnicodeQuery(self):
+		index = chatbot.model.titleIndex.typoIndex
+		self.assertEqual(index.lookup(u'amélie'), index.lookup('am\xc3\xa9lie'))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+End to end tests of /fb_webhook: real JSON in, replies posted to a local stub
+of the Send API. Run from the repository root with
+`python -m unittest discover tests`.
+"""
+
+import BaseHTTPServer
+import collections
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT) # The data files are read relative to the repository root
+
+sent = collections.defaultdict(list) # Recipient id -> texts posted to the stub
+
+class SendApiStub(BaseHTTPServer.BaseHTTPRequestHandler):
+	def do_POST(self):
+		payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+		sent[payload['recipient']['id']].append(payload['message']['text'])
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.end_headers()
+		self.wfile.write('{}')
+
+	def log_message(self, format, *args):
+		pass
+
+def setUpModule():
+	global app, server, directory
+	server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), SendApiStub)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	directory = tempfile.mkdtemp()
+	os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(directory, 'app.db')
+	os.environ['FACEBOOK_PAGE_ACCESS_TOKEN'] = 'token'
+	os.environ['FACEBOOK_API_MESSAGE_SEND_URL'] = 'http://127.0.0.1:%d/messages?access_token=%%s' % server.server_port
+	import app
+	app.db.create_all()
+	app.model_warmup.get()
+
+def tearDownModule():
+	app.shutdown() # Writes back the sessions while the database is still there
+	server.shutdown()
+	shutil.rmtree(directory)
+
+class WebhookTest(unittest.TestCase):
+	def setUp(self):
+		sent.clear()
+		self.client = app.app.test_client()
+
+	def post(self, messages):
+		"""Posts (sender id, text) messages as one webhook call, returns once the replies are sent"""
+		events = [{'sender': {'id': sender_id}, 'recipient': {'id': 'page'}, 'message': {'mid': 'm%d' % i, 'text': text}}
+			for i, (sender_id, text) in enumerate(messages)]
+		body = json.dumps({'object': 'page', 'entry': [{'id': 'page', 'messaging': events}]})
+		response = self.client.post('/fb_webhook', data=body, content_type='application/json')
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(app.events.join(60))
+		self.assertTrue(app.messenger.flush(60))
+
+	def testTitlesNextToNonAsciiTitles(self):
+		# Each of these is scored against titles with non-ASCII characters
+		self.post([('toy', 'I hated "Toy Story"'), ('heat', 'I loved "Heat"'), ('alien', 'I enjoyed "Alien"')])
+		for sender_id in ['toy', 'heat', 'alien']:
+			self.assertEqual(len(sent[sender_id]), 1, sender_id)
+
+	def testNonAsciiMessage(self):
+		self.post([('amelie', u'J\'ai adoré "Amélie"')])
+		self.assertEqual(len(sent['amelie']), 1)
+
+	def testEverySenderAnswered(self):
+		self.post([('a', 'I loved "Titanic (1997)"'), ('b', 'I liked "c++"'), ('a', 'hello')])
+		self.assertEqual(len(sent['a']), 2)
+		self.assertEqual(len(sent['b']), 1)
+		self.assertIn('a', app.sessions.sessions)
+
+	def testSessionFromDatabase(self):
+		self.post([('titanic', 'I loved "Titanic"')])
+		app.sessions.flush()
+		app.sessions.sessions.clear() # Next message picks the conversation up from its JSON
+		self.post([('titanic', '1')])
+		self.assertEqual(len(sent['titanic']), 2)
+
+if __name__ == '__main__':
+	unittest.main()